@@ -1,131 +1,271 @@
 import os
-import json
+from typing import Callable, List
 
 import dash
-import dash_core_components as dcc
-from dash_core_components.Graph import Graph
-import dash_html_components as html
-from dash.dependencies import Input, Output
-from dash_html_components.Div import Div
-import plotly.graph_objects as go
-import pandas as pd
+from dash import dcc, html
+from dash.dependencies import Input, Output, State
 
+import app_data
 import create_figs
+import figure_cache
+import figure_payload
 
-data_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-
-installs_dict = create_figs.formula_installs(
-    os.path.join(data_dir, "formula_installs.csv")
+# The data folder can be swapped out, e.g. by the benchmarks, with this variable
+data_dir = os.environ.get(
+    "HOMEBREW_ANALYTICS_DATA", os.path.join(os.path.dirname(__file__), "..", "data")
 )
 
-ratios_dict = create_figs.request_ratio(os.path.join(data_dir, "formula_installs.csv"))
+# How many of the most depended upon packages the dependency matrix shows
+dep_matrix_size = 100
 
-dep_heatmap = create_figs.dep_matrix(os.path.join(data_dir, "dep_graph.json"))
+# Most memory the callbacks' figure cache may use, and how many of the most depended
+# upon formulae to build trees for when the server starts
+figure_cache_max_bytes = 256 * 1024**2
+figure_cache_prewarm = 50
 
-dep_tree = create_figs.create_dep_tree(
-    os.path.join(data_dir, "dep_graph.json"), "trimage"
-)
+# Every file the figures are made from, read on first use and re-read if it changes
+data = app_data.AppData(data_dir)
+
+# Figures the callbacks already built, kept as JSON so repeat requests skip building
+# them. Keyed by the data they were built from too, so new data is never hidden
+figures = figure_cache.FigureCache(figure_cache_max_bytes)
+
+
+def cached_figure(callback: str, args: tuple, sources: List[str], build: Callable):
+    key = (callback, args, tuple(data.version(s) for s in sources))
+    return figures.get(key, build)
+
+
+# The files the installs chart is drawn from. The history folder's version changes
+# whenever a snapshot is added to it
+installs_sources = [
+    "top_formulae.csv",
+    "formula_installs.csv",
+    os.path.join("history", "formula_installs"),
+]
+# And the ratio chart's
+ratio_sources = ["top_formulae.csv", "formula_installs.csv"]
+
+
+def installs_figures():
+    history_dir = data.path("history")
+    return data.derived(
+        "installs_figures",
+        installs_sources,
+        lambda: (
+            create_figs.plot_formula_history(create_figs.formula_history(history_dir))
+            if create_figs.has_history(history_dir)
+            else create_figs.plot_formula_installs(data.top_formulae())
+        ),
+    )
+
+
+def ratios_figures():
+    return data.derived(
+        "ratios_figures",
+        ratio_sources,
+        lambda: create_figs.plot_request_ratio(data.top_formulae()),
+    )
+
+
+def line_charts():
+    """
+    The installs chart of every OS, for the browser to switch between by itself
+    """
+    return data.derived(
+        "line_charts",
+        installs_sources,
+        lambda: figure_payload.variants(installs_figures()),
+    )
+
+
+def ratio_charts():
+    """
+    The request ratio chart of every OS, for the browser to switch between by itself
+    """
+    return data.derived(
+        "ratio_charts",
+        ratio_sources,
+        lambda: figure_payload.variants(ratios_figures()),
+    )
+
+
+def dep_heatmap():
+    return data.derived(
+        "dep_heatmap",
+        ["dep_graph.json"],
+        lambda: figure_payload.compact(
+            create_figs.plot_dep_matrix(data.dep_edges(), dep_matrix_size)
+        ),
+    )
 
 
 def get_tree_options():
-    with open(os.path.join(data_dir, "dep_graph.json")) as fio:
-        deps = json.loads(fio.read())
-    return (
-        pd.DataFrame(data=deps, columns=["package", "depends_on"])
-        .sort_values("package")
-        .package.unique()
+    return data.tree_options()
+
+
+def tree_chart(formula: str):
+    return cached_figure(
+        "tree",
+        (formula,),
+        ["dep_closure.json"],
+        lambda: create_figs.create_dep_tree_from_closure(data.dep_closure(), formula),
     )
 
 
+def graph_metrics_chart(metric: str):
+    return cached_figure(
+        "graph_metrics",
+        (metric,),
+        ["graph_metrics.csv"],
+        lambda: create_figs.plot_graph_metrics(data.graph_metrics(), metric),
+    )
+
+
+def prewarm_figures(n_formulas: int = figure_cache_prewarm):
+    """
+    Build the line and ratio charts for every OS, and put the graph metric charts in
+    the figure cache, along with the trees of the n_formulas formulae in
+    depended_upon_formulae.csv that are depended on most
+    """
+    line_charts()
+    ratio_charts()
+    for metric in create_figs.graph_metric_titles:
+        graph_metrics_chart(metric)
+
+    counts = data.get("depended_upon_formulae.csv")
+    options = set(get_tree_options())
+    popular = counts.sort_values("count", ascending=False).formula
+    for formula in [f for f in popular if f in options][:n_formulas]:
+        tree_chart(formula)
+
+
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
-app.layout = html.Div(
-    [
-        html.H1(
-            "Homebrew Analytics: EN 605.462 Final Project",
-            style=dict(textAlign="center"),
-        ),
-        html.H6("Nathan McIntosh", style=dict(textAlign="center")),
-        html.Div(
-            [
-                dcc.Graph(id="dep-matrix", figure=dep_heatmap),
-                dcc.Dropdown(
-                    id="popularity-line-dropdown",
-                    options=[
-                        dict(label="MacOS", value="macos"),
-                        dict(label="Linux", value="linux"),
-                    ],
-                    value="macos",
-                    clearable=False,
-                ),
-                dcc.Graph(id="popularity-line-figure"),
-            ],
-            style={
-                "width": "49%",
-                "display": "inline-block",
-                "vertical-align": "middle",
-            },
-        ),
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="tree-dropdown",
-                    options=[dict(label=v, value=v) for v in get_tree_options()],
-                    value="python@3.9",
-                    searchable=True,
-                ),
-                dcc.Graph(id="tree-figure"),
-                dcc.Dropdown(
-                    id="request-ratio-dropdown",
-                    options=[
-                        dict(label="MacOS", value="macos"),
-                        dict(label="Linux", value="linux"),
-                    ],
-                    value="macos",
-                    clearable=False,
-                ),
-                dcc.Graph(id="request-ratio-figure"),
-            ],
-            style={
-                "width": "49%",
-                "display": "inline-block",
-                "vertical-align": "middle",
-            },
-        ),
-    ],
-)
 
+def serve_layout():
+    """
+    The page, built when it is loaded rather than at import, so that nothing is read
+    until the first visitor arrives, and each visit sees the latest data
+    """
+    return html.Div(
+        [
+            html.H1(
+                "Homebrew Analytics: EN 605.462 Final Project",
+                style=dict(textAlign="center"),
+            ),
+            html.H6("Nathan McIntosh", style=dict(textAlign="center")),
+            html.Div(
+                [
+                    dcc.Graph(id="dep-matrix", figure=dep_heatmap()),
+                    dcc.Dropdown(
+                        id="popularity-line-dropdown",
+                        options=[
+                            dict(label="MacOS", value="macos"),
+                            dict(label="Linux", value="linux"),
+                        ],
+                        value="macos",
+                        clearable=False,
+                    ),
+                    dcc.Graph(id="popularity-line-figure"),
+                    dcc.Store(id="popularity-line-store", data=line_charts()),
+                    dcc.Dropdown(
+                        id="graph-metrics-dropdown",
+                        options=[
+                            dict(label=title, value=metric)
+                            for metric, title in create_figs.graph_metric_titles.items()
+                        ],
+                        value="transitive_dependents",
+                        clearable=False,
+                    ),
+                    dcc.Graph(id="graph-metrics-figure"),
+                ],
+                style={
+                    "width": "49%",
+                    "display": "inline-block",
+                    "vertical-align": "middle",
+                },
+            ),
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="tree-dropdown",
+                        options=[dict(label=v, value=v) for v in get_tree_options()],
+                        value="python@3.9",
+                        searchable=True,
+                    ),
+                    dcc.Graph(id="tree-figure"),
+                    dcc.Dropdown(
+                        id="request-ratio-dropdown",
+                        options=[
+                            dict(label="MacOS", value="macos"),
+                            dict(label="Linux", value="linux"),
+                        ],
+                        value="macos",
+                        clearable=False,
+                    ),
+                    dcc.Graph(id="request-ratio-figure"),
+                    dcc.Store(id="request-ratio-store", data=ratio_charts()),
+                ],
+                style={
+                    "width": "49%",
+                    "display": "inline-block",
+                    "vertical-align": "middle",
+                },
+            ),
+        ],
+    )
 
-@app.callback(
+
+app.layout = serve_layout
+
+
+# The charts of every OS are in the page already, so picking one doesn't ask the server
+app.clientside_callback(
+    figure_payload.with_template,
     Output("popularity-line-figure", "figure"),
     [Input("popularity-line-dropdown", "value")],
+    [State("popularity-line-store", "data")],
 )
-def update_line_chart(which_os):
-    fig = installs_dict[which_os]
-    return fig
 
-
-@app.callback(
-    Output("request-ratio-figure", "figure"), [Input("request-ratio-dropdown", "value")]
+app.clientside_callback(
+    figure_payload.with_template,
+    Output("request-ratio-figure", "figure"),
+    [Input("request-ratio-dropdown", "value")],
+    [State("request-ratio-store", "data")],
 )
-def update_ratio_chart(which_os):
-    fig = ratios_dict[which_os]
-    return fig
 
 
 @app.callback(Output("tree-figure", "figure"), [Input("tree-dropdown", "value")])
 def update_tree_chart(which_formula):
-    return create_figs.create_dep_tree(
-        os.path.join(data_dir, "dep_graph.json"), which_formula
-    )
+    return tree_chart(which_formula)
+
+
+@app.callback(
+    Output("graph-metrics-figure", "figure"), [Input("graph-metrics-dropdown", "value")]
+)
+def update_graph_metrics_chart(metric):
+    return graph_metrics_chart(metric)
+
+
+@app.server.route("/figure-cache")
+def figure_cache_report():
+    """
+    Hit and miss counts and the size of the figure cache, as JSON
+    """
+    return figures.report()
 
 
 if __name__ == "__main__":
     # Collect and save all the relevant data
     from get_and_clean_data import main as data_main
+
     data_main()
 
+    # Have the most requested figures ready before the first visitor asks for them
+    prewarm_figures()
+
     # Run the server
-    app.run_server(debug=True)
+    app.run(debug=True)
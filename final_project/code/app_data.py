@@ -0,0 +1,105 @@
+"""
+The data the app draws its figures from. Each file is read the first time something
+asks for it, and the same in-memory copy is handed to every figure after that. When a
+file is rewritten, e.g. by a data refresh, it is read again the next time it's asked for,
+so the server never has to be restarted to show new data
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+import create_figs
+import edge_store
+import rankings
+import storage
+
+
+class AppData:
+    """
+    Loads the files in `data_dir` lazily, and keeps each one until its version (see
+    storage.file_version) changes. Values computed from the files, such as figures, can
+    be kept the same way with derived(), and are rebuilt when a file they use changes
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        # name: (version, value), for files and for values derived from them
+        self.files: Dict[str, tuple] = dict()
+        self.derived_values: Dict[str, tuple] = dict()
+        # Callbacks run on several threads, and each file should only be read once
+        self.lock = threading.RLock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    def version(self, name: str) -> tuple:
+        return storage.file_version(self.path(name))
+
+    def get(self, name: str, loader: Callable[[str], Any] = None) -> Any:
+        """
+        The contents of the file `name`, read with loader(path), which is
+        storage.read_frame by default, if it changed since it was last read
+        """
+        loader = storage.read_frame if loader is None else loader
+        with self.lock:
+            version = self.version(name)
+            if name not in self.files or self.files[name][0] != version:
+                self.files[name] = (version, loader(self.path(name)))
+            return self.files[name][1]
+
+    def derived(self, name: str, sources: List[str], build: Callable[[], Any]) -> Any:
+        """
+        The value build() returns, computed once and kept until one of the files in
+        `sources` changes
+        """
+        with self.lock:
+            version = tuple(self.version(s) for s in sources)
+            if (
+                name not in self.derived_values
+                or self.derived_values[name][0] != version
+            ):
+                self.derived_values[name] = (version, build())
+            return self.derived_values[name][1]
+
+    def formula_installs(self) -> pd.DataFrame:
+        return self.get("formula_installs.csv")
+
+    def top_formulae(self) -> pd.DataFrame:
+        """
+        The ranked top formulae of every OS, window and metric (see rankings.py), from
+        top_formulae.csv, or made from formula_installs.csv if the data step that
+        wrote it predates that file
+        """
+        return self.derived(
+            "top_formulae",
+            ["top_formulae.csv", "formula_installs.csv"],
+            lambda: (
+                self.get("top_formulae.csv")
+                if os.path.isfile(self.path("top_formulae.csv"))
+                else rankings.top_n_table(self.formula_installs())
+            ),
+        )
+
+    def graph_metrics(self) -> pd.DataFrame:
+        return self.get("graph_metrics.csv")
+
+    def dep_edges(self) -> pd.DataFrame:
+        return self.get("dep_graph.json", edge_store.read_graph)
+
+    def dep_closure(self) -> Dict[str, dict]:
+        return self.get("dep_closure.json", create_figs.load_dep_closure)
+
+    def tree_options(self) -> List[str]:
+        """
+        Every formula that has dependencies, in order, to pick a tree from
+        """
+        return self.derived(
+            "tree_options",
+            ["dep_closure.json"],
+            lambda: sorted(
+                f for f, i in self.dep_closure().items() if i["dependencies"]
+            ),
+        )
@@ -0,0 +1,116 @@
+"""
+Download many JSON documents concurrently with asyncio and aiohttp
+"""
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, List
+from urllib.parse import urlsplit
+from warnings import warn
+
+import aiohttp
+
+
+# Responses worth trying again, rather than treating as "this formula has no data"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """
+    Space out requests so that no single host sees more than `per_second` of them
+    """
+
+    def __init__(self, per_second: float = None):
+        self.interval = 1 / per_second if per_second else 0
+        self.next_slot: Dict[str, float] = dict()
+        self.lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+def fetch_json_many(
+    urls: Iterable[str],
+    concurrency: int = 32,
+    per_host_rate: float = None,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = 10,
+) -> List[dict]:
+    """
+    Get the JSON at each url, in the same order as `urls`. A url that does not exist,
+    or still fails after `retries` retries, gives an empty dict.
+
+    At most `concurrency` requests are in flight at once, over a shared pool of
+    keep-alive connections, and each host gets at most `per_host_rate` requests per
+    second if it is given. The n-th retry waits backoff * 2**(n - 1) seconds, so
+    backoff, then twice that, and so on.
+    """
+    return asyncio.run(
+        fetch_json_many_async(
+            list(urls), concurrency, per_host_rate, retries, backoff, timeout
+        )
+    )
+
+
+async def fetch_json_many_async(
+    urls: List[str],
+    concurrency: int = 32,
+    per_host_rate: float = None,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = 10,
+) -> List[dict]:
+    """
+    The coroutine behind fetch_json_many()
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(per_host_rate)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        return await asyncio.gather(
+            *[
+                fetch_json(session, url, semaphore, limiter, retries, backoff)
+                for url in urls
+            ]
+        )
+
+
+async def fetch_json(
+    session: aiohttp.ClientSession,
+    url: str,
+    semaphore: asyncio.Semaphore,
+    limiter: HostRateLimiter,
+    retries: int,
+    backoff: float,
+) -> dict:
+    """
+    Get a dict from a JSON API, retrying transient failures with exponential backoff
+    """
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        async with semaphore:
+            await limiter.wait(host)
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return json.loads(await response.read())
+                    if response.status not in RETRY_STATUSES:
+                        return dict()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+
+    warn(f"Could not read {url} after {retries + 1} attempts")
+    return dict()
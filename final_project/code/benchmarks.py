@@ -0,0 +1,476 @@
+"""
+Time and memory benchmarks for the data pipeline, the figures and the app's callbacks.
+Everything runs offline, on synthetic data shaped like homebrew's at multiples of the
+example_data sizes. The results of each run are saved as JSON, named after the current
+commit, so that two commits can be compared. From the `final_project` folder, run
+    python code/benchmarks.py --scales 1 10 100
+    python code/benchmarks.py --compare benchmark_results/<older commit>.json
+"""
+
+import argparse
+import importlib
+import json
+import io
+import os
+import pathlib
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Tuple
+from warnings import warn
+
+import pandas as pd
+
+import app_data
+import create_figs
+import edge_store
+import figure_cache
+import get_and_clean_data
+import rankings
+import schema
+import storage
+
+this_dir = os.path.dirname(__file__)
+results_dir = os.path.join(this_dir, "..", "benchmark_results")
+
+# About how many entries each feed in example_data has, which the scales multiply
+formulae_per_feed = 8000
+casks_per_feed = 7300
+build_errors_per_feed = 3300
+
+
+def measure(
+    func: Callable, repeat: int = 3, setup: Callable = None
+) -> Dict[str, float]:
+    """
+    Best wall time over `repeat` calls of func(), and the peak memory python allocated
+    during one more call. setup(), if given, runs untimed before every call, e.g. to
+    empty a cache
+    """
+    setup = setup or (lambda: None)
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(seconds=min(times), peak_mb=peak / 1e6)
+
+
+def synthetic_items_payload(
+    n_items: int, seed: int = 0, names: List[str] = None, key: str = "formula"
+) -> bytes:
+    """
+    An analytics response shaped like homebrew's, with `n_items` formulae (or casks, if
+    key="cask") whose install counts fall off the way real package popularity does.
+    The names are drawn from `names` if given, and are formula-0, formula-1, ... if not
+    """
+    rng = random.Random(seed)
+    if names is None:
+        names = [f"{key}-{i}" for i in range(n_items)]
+    else:
+        names = rng.sample(names, min(n_items, len(names)))
+    counts = sorted((int(1e6 / rng.paretovariate(1.2)) for _ in names))[::-1]
+    total = sum(counts)
+    items = [
+        {
+            "number": i + 1,
+            key: name,
+            "count": f"{c:,}",
+            "percent": f"{100 * c / total:.2f}",
+        }
+        for i, (name, c) in enumerate(zip(names, counts))
+    ]
+    return json.dumps(
+        dict(category=f"{key}_install", total_items=len(items), items=items)
+    ).encode()
+
+
+def synthetic_formula_json(n_formulae: int, seed: int = 0) -> List[dict]:
+    """
+    A formula catalog like homebrew's formula.json, for formula-0 ... formula-N.
+    Formulae only depend on ones listed before them, so there are no cycles. Like the
+    real catalog, about a third have dependencies, a few have dozens, and popular
+    dependencies gather more dependents (the way openssl and python do), which gives a
+    long tailed number of dependents and chains around a dozen deep
+    """
+    rng = random.Random(seed)
+    names = [f"formula-{i}" for i in range(n_formulae)]
+    # One entry per edge, so picking from it favours formulae with many dependents
+    depended_upon = []
+
+    catalog = []
+    for i, name in enumerate(names):
+        n_deps = 0
+        if i > 0 and rng.random() < 0.35:
+            n_deps = min(int(rng.paretovariate(1.3)), 30, i)
+        deps = set()
+        while len(deps) < n_deps:
+            if depended_upon and rng.random() < 0.7:
+                deps.add(rng.choice(depended_upon))
+            else:
+                # Mostly recent formulae, which is what builds up long chains
+                deps.add(names[max(0, i - 1 - int(rng.expovariate(1 / 50)))])
+        depended_upon.extend(deps)
+
+        requirements = []
+        if rng.random() < 0.05:
+            requirements.append(
+                dict(name="xcode", cask=None, download=None, version=None, contexts=[])
+            )
+        catalog.append(
+            dict(
+                name=name,
+                dependencies=sorted(deps),
+                recommended_dependencies=[],
+                optional_dependencies=[],
+                requirements=requirements,
+            )
+        )
+    return catalog
+
+
+def synthetic_analytics(scale: int, seed: int = 0) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield a url and body for every url in get_and_clean_data.install_and_error_urls, at
+    `scale` times the size of the feeds in example_data. Longer windows list more
+    formulae
+    """
+    formulae = [f"formula-{i}" for i in range(formulae_per_feed * scale)]
+    casks = [f"cask-{i}" for i in range(casks_per_feed * scale)]
+    share = {30: 0.85, 90: 0.92, 365: 1.0}
+
+    for i, url in enumerate(get_and_clean_data.install_and_error_urls):
+        info = get_and_clean_data.parse_analytics_url(url)
+        if info["event"] == "cask-install":
+            names, key, n_items = casks, "cask", casks_per_feed * scale
+        elif info["event"] == "build-error":
+            names, key, n_items = formulae, "formula", build_errors_per_feed * scale
+        else:
+            names, key, n_items = formulae, "formula", formulae_per_feed * scale
+        n_items = int(n_items * share[info["n_days"]])
+        yield url, synthetic_items_payload(n_items, seed + i, names, key)
+
+
+def write_synthetic_sources(directory: str, scale: int, seed: int = 0) -> dict:
+    """
+    Save synthetic analytics feeds under `directory`, laid out like the paths of their
+    urls, and a formula catalog to match. Returns the paths and file:// urls of the
+    feeds, in the order of install_and_error_urls, and the path of the catalog
+    """
+    paths = []
+    for url, body in synthetic_analytics(scale, seed):
+        path = os.path.join(directory, url.split("formulae.brew.sh/")[1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+        paths.append(path)
+
+    catalog = os.path.join(directory, "formula.json")
+    with open(catalog, "w") as f:
+        f.write(json.dumps(synthetic_formula_json(formulae_per_feed * scale, seed)))
+    urls = [pathlib.Path(p).absolute().as_uri() for p in paths]
+    return dict(paths=paths, urls=urls, catalog=catalog)
+
+
+def graph_summary(dep_closure: Dict[str, dict]) -> dict:
+    """
+    A few numbers describing a dependency graph, to check synthetic graphs look real
+    """
+    return dict(
+        formulae=len(dep_closure),
+        edges=sum(len(v["dependencies"]) for v in dep_closure.values()),
+        max_dependencies=max(len(v["dependencies"]) for v in dep_closure.values()),
+        max_dependents=max(len(v["dependents"]) for v in dep_closure.values()),
+        max_depth=max(v["depth"] for v in dep_closure.values()),
+    )
+
+
+def bench_pipeline(sources: dict, data_dir: str, repeat: int) -> Dict[str, dict]:
+    """
+    Time the public functions in get_and_clean_data that don't need the network, and
+    save their output to `data_dir` in the same files main() writes
+    """
+    results = dict()
+
+    def run(name: str, func: Callable):
+        # Keep what the last call returned, to feed the next steps
+        output = [None]
+        results[f"get_and_clean_data.{name}"] = measure(
+            lambda: output.__setitem__(0, func()), repeat
+        )
+        return output[0]
+
+    data_dict = run(
+        "get_analytics_dfs",
+        lambda: get_and_clean_data.get_analytics_dfs(sources["urls"]),
+    )
+    # The biggest feed, a year of installs
+    with open(sources["paths"][2], "rb") as f:
+        body = f.read()
+    run(
+        "build_df_from_items",
+        lambda: get_and_clean_data.build_df_from_items(json.loads(body)),
+    )
+    run(
+        "build_df_from_items_stream",
+        lambda: get_and_clean_data.build_df_from_items_stream(io.BytesIO(body)),
+    )
+    formulae = run(
+        "get_unique_formulas",
+        lambda: get_and_clean_data.get_unique_formulas(list(data_dict.values())),
+    )
+    formula_json = run(
+        "get_formula_json_bulk",
+        lambda: get_and_clean_data.get_formula_json_bulk(formulae, sources["catalog"]),
+    )
+    dep_graph = run(
+        "create_dependencies_graph",
+        lambda: get_and_clean_data.create_dependencies_graph(
+            formula_json, "dependencies"
+        ),
+    )
+    edges = run("edge_store.build", lambda: edge_store.build(formula_json))
+    run("edge_store.edge_list", lambda: edge_store.edge_list(edges, "dependencies"))
+    dep_closure = run(
+        "create_dependency_closure",
+        lambda: get_and_clean_data.create_dependency_closure(dep_graph),
+    )
+    formula_installs = run(
+        "create_formula_install_df",
+        lambda: get_and_clean_data.create_formula_install_df(data_dict),
+    )
+    run("top_n_table", lambda: rankings.top_n_table(formula_installs))
+    run(
+        "create_cask_install_df",
+        lambda: get_and_clean_data.create_cask_install_df(data_dict),
+    )
+    run(
+        "create_build_errors_df",
+        lambda: get_and_clean_data.create_build_errors_df(data_dict),
+    )
+    run(
+        "save_table",
+        lambda: get_and_clean_data.save_table(
+            formula_installs, os.path.join(data_dir, "formula_installs.csv")
+        ),
+    )
+    get_and_clean_data.save_table(
+        rankings.top_n_table(formula_installs),
+        os.path.join(data_dir, "top_formulae.csv"),
+    )
+
+    get_and_clean_data.save_graph(dep_graph, os.path.join(data_dir, "dep_graph.json"))
+    edge_store.save(edges, os.path.join(data_dir, edge_store.store_name))
+    get_and_clean_data.save_json(
+        dep_closure, os.path.join(data_dir, "dep_closure.json")
+    )
+    return results
+
+
+def bench_figures(data_dir: str, formula: str, repeat: int) -> Dict[str, dict]:
+    """
+    Time building each figure in create_figs from the files in `data_dir`, drawing
+    the dependency tree of `formula`
+    """
+    installs_file = os.path.join(data_dir, "formula_installs.csv")
+    top_file = os.path.join(data_dir, "top_formulae.csv")
+    graph_file = os.path.join(data_dir, "dep_graph.json")
+    closure_file = os.path.join(data_dir, "dep_closure.json")
+
+    closure = create_figs.load_dep_closure(closure_file)
+    edges = edge_store.read_graph(graph_file)
+
+    benches = dict(
+        formula_installs=lambda: create_figs.formula_installs(top_file),
+        request_ratio=lambda: create_figs.request_ratio(top_file),
+        top_n_table=lambda: rankings.top_n_table(storage.read_frame(installs_file)),
+        dep_matrix=lambda: create_figs.dep_matrix(graph_file),
+        create_dep_tree=lambda: create_figs.create_dep_tree(graph_file, formula),
+        load_dep_closure=lambda: create_figs.load_dep_closure(closure_file),
+        create_dep_tree_from_closure=lambda: create_figs.create_dep_tree_from_closure(
+            closure, formula
+        ),
+        read_graph=lambda: edge_store.read_graph(graph_file),
+        read_graph_json=lambda: storage.read_frame(graph_file),
+        edge_adjacency=lambda: create_figs.edge_adjacency(edges),
+    )
+    return {f"create_figs.{k}": measure(v, repeat) for k, v in benches.items()}
+
+
+def bench_app(data_dir: str, formula: str, repeat: int) -> Dict[str, dict]:
+    """
+    Time building the app's page from the data in `data_dir`, which carries every OS's
+    installs and ratio charts, and each of its server callbacks. Each is timed from an
+    empty start, with nothing read or built yet, and again as a .cache_hit, when
+    everything it needs is already in memory. Returns nothing if dash can't be imported
+    """
+    os.environ["HOMEBREW_ANALYTICS_DATA"] = data_dir
+
+    # Importing the app doesn't read any data, that waits for the first page or callback
+    sys.modules.pop("app", None)
+    try:
+        app = importlib.import_module("app")
+    except ImportError as e:
+        warn(f"Skipping the app benchmarks, could not import it ({e})")
+        return dict()
+    results = dict()
+
+    # Dash wraps callbacks to be called by the server, the functions are underneath
+    def callback(name: str) -> Callable:
+        func = getattr(app, name)
+        return getattr(func, "__wrapped__", func)
+
+    # Forget every file read and figure built, as if the server had just started
+    def cold():
+        app.data = app_data.AppData(data_dir)
+        app.figures = figure_cache.FigureCache(app.figure_cache_max_bytes)
+
+    metric = next(iter(create_figs.graph_metric_titles))
+    benches = dict(
+        serve_layout=lambda: app.serve_layout(),
+        update_tree_chart=lambda: callback("update_tree_chart")(formula),
+        update_graph_metrics_chart=lambda: callback("update_graph_metrics_chart")(
+            metric
+        ),
+    )
+    for name, bench in benches.items():
+        results[f"app.{name}"] = measure(bench, repeat, cold)
+        results[f"app.{name}.cache_hit"] = measure(bench, repeat)
+    return results
+
+
+def run_benchmarks(scales: List[int], seed: int = 0) -> dict:
+    """
+    Run every benchmark at each scale, in a temporary folder that is deleted after
+    """
+    report = dict(
+        commit=current_commit(),
+        created=datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        pandas=pd.__version__,
+        results=dict(),
+        data=dict(),
+    )
+    for scale in scales:
+        # Big scales take a while, so only take the best of several runs on small ones
+        repeat = 3 if scale < 10 else 1
+        with tempfile.TemporaryDirectory() as directory:
+            data_dir = os.path.join(directory, "data")
+            os.makedirs(data_dir)
+            sources = write_synthetic_sources(directory, scale, seed)
+
+            results = bench_pipeline(sources, data_dir, repeat)
+            closure = create_figs.load_dep_closure(
+                os.path.join(data_dir, "dep_closure.json")
+            )
+            # Draw the tree of the formula with the most dependencies
+            formula = max(closure, key=lambda f: len(closure[f]["transitive"]))
+            results.update(bench_figures(data_dir, formula, repeat))
+            results.update(bench_app(data_dir, formula, repeat))
+
+        report["results"][str(scale)] = results
+        report["data"][str(scale)] = graph_summary(closure)
+        print_results(f"{scale}x", results)
+    return report
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=this_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(title: str, results: Dict[str, dict]):
+    print(title)
+    for name, result in results.items():
+        print(f"    {name:<50} {result['seconds']:8.3f}s {result['peak_mb']:9.1f}MB")
+
+
+def compare_reports(old: dict, new: dict, threshold: float = 1.25) -> pd.DataFrame:
+    """
+    Wall time and peak memory of every benchmark in both reports, as new / old ratios.
+    A benchmark regressed if either ratio is above `threshold`
+    """
+    rows = []
+    for scale, results in new["results"].items():
+        for name, result in results.items():
+            before = old["results"].get(scale, dict()).get(name)
+            if before is None:
+                continue
+            rows.append(
+                dict(
+                    scale=scale,
+                    benchmark=name,
+                    seconds=result["seconds"],
+                    time_ratio=result["seconds"] / max(before["seconds"], 1e-9),
+                    peak_mb=result["peak_mb"],
+                    memory_ratio=result["peak_mb"] / max(before["peak_mb"], 1e-9),
+                )
+            )
+    comparison = pd.DataFrame(rows)
+    if len(comparison) > 0:
+        comparison["regressed"] = (comparison.time_ratio > threshold) | (
+            comparison.memory_ratio > threshold
+        )
+    return comparison
+
+
+def schema_memory_report(data_dir: str) -> pd.DataFrame:
+    """
+    Bytes used by each table in `data_dir` when read with pandas' default dtypes, and
+    when read with the compact dtypes in schema.py
+    """
+    tables = ["formula_installs", "cask_installs", "build_errors"]
+    before = {t: pd.read_csv(os.path.join(data_dir, f"{t}.csv")) for t in tables}
+    after = {t: schema.apply_schema(df) for t, df in before.items()}
+    return schema.memory_report(before, after)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="where to save the results, by default named after the commit"
+    )
+    parser.add_argument("--compare", help="results of an earlier run to compare to")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scales, args.seed)
+
+    output = args.output or os.path.join(results_dir, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        f.write(json.dumps(report, indent=2))
+    print(f"Saved results to {output}")
+
+    example_data = os.path.join(this_dir, "..", "example_data")
+    print(schema_memory_report(example_data).to_string(index=False))
+
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare_reports(json.loads(f.read()), report, args.threshold)
+        print(comparison.to_string(index=False))
+        if len(comparison) > 0 and comparison.regressed.any():
+            sys.exit(1)
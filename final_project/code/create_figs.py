@@ -1,40 +1,102 @@
 import enum
 import json
 import os
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import itertools as it
-from io import StringIO
-from pprint import pprint
-import re
 
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 
+import edge_store
+import history
+import rankings
+import schema
+import storage
+import tree_layout
 
-def formula_installs(file: str) -> Dict[str, go.Figure]:
+
+def formula_installs(file: str, history_dir: str = None) -> Dict[str, go.Figure]:
     """
     formula_installs will produce a lineplot of total package installs for a given
-    package over 30, 90, and 365 days
-    """
-    assert os.path.isfile(file), f"Could not find installs csv {file}"
-    df = pd.read_csv(file)
-    df["normalized_count"] = df.count_regular / df.n_days
-    df.n_days = df.n_days * -1
-
-    mac = (
-        df.loc[df.os.eq("macos")]
-        .groupby("n_days")
-        .head(20)
-        .sort_values("normalized_count", ascending=False)
+    package over 30, 90, and 365 days, from top_formulae.csv or formula_installs.csv.
+    If history_dir has more than one snapshot of the formula installs (see
+    history.py), it plots their history instead
+    """
+    if has_history(history_dir):
+        return plot_formula_history(formula_history(history_dir))
+    return plot_formula_installs(storage.read_frame(file))
+
+
+def has_history(history_dir: str, table: str = "formula_installs") -> bool:
+    """
+    Whether there are enough snapshots of `table` in history_dir to draw a history
+    """
+    return (
+        history_dir is not None and len(history.snapshot_dates(history_dir, table)) > 1
+    )
+
+
+def formula_history(history_dir: str, n: int = 20, n_days: int = 30) -> pd.DataFrame:
+    """
+    The installs over n_days of the top n formulae on each OS, as of the latest
+    snapshot, in every snapshot in history_dir
+    """
+    columns = ["formula", "count_regular", "os", "n_days"]
+    latest = history.read_snapshot(
+        history_dir,
+        "formula_installs",
+        history.snapshot_dates(history_dir, "formula_installs")[-1],
+        columns=columns,
+    )
+    latest = latest.loc[latest.n_days.eq(n_days)]
+    top = latest.sort_values("count_regular", ascending=False).groupby("os").head(n)
+
+    df = history.trend(
+        history_dir, "formula_installs", top.formula.unique().tolist(), columns=columns
     )
-    linux = (
-        df.loc[df.os.eq("linux")]
-        .groupby("n_days")
-        .head(20)
-        .sort_values("normalized_count", ascending=False)
+    # Each OS only keeps its own top formulae
+    keep = df.set_index(["os", "formula"]).index.isin(
+        top.set_index(["os", "formula"]).index
     )
+    return df.loc[keep & df.n_days.eq(n_days)]
+
+
+def plot_formula_history(df: pd.DataFrame) -> Dict[str, go.Figure]:
+    """
+    Lineplots of each formula's installs per day over time, one per OS, from the rows
+    of formula_history
+    """
+    df = df.assign(normalized_count=df.count_regular / df.n_days)
+    figs = dict()
+    for which_os, title in [("macos", "Mac"), ("linux", "Linux")]:
+        os_df = df.loc[df.os.eq(which_os)]
+        figs[which_os] = px.line(
+            os_df.sort_values("date"),
+            x="date",
+            y="normalized_count",
+            color="formula",
+            line_group="formula",
+            markers=True,
+            labels={"date": "Date", "normalized_count": "Installs per Day"},
+            title=f"Top {os_df.formula.nunique()} {title} Formula Installs",
+        )
+    return figs
+
+
+def plot_formula_installs(df: pd.DataFrame, n: int = 20) -> Dict[str, go.Figure]:
+    """
+    The figures of formula_installs for the top n formulae of each window, from an
+    already loaded top_n_table (see rankings.py), or table of formula installs. df is
+    not modified, so it can be shared with other figures
+    """
+    top = rankings.ensure_table(df)
+    top = top.loc[top.metric.eq("count_regular") & top["rank"].le(n)]
+    df = top.assign(normalized_count=top.value / top.n_days, n_days=top.n_days * -1)
+
+    mac = df.loc[df.os.eq("macos")].sort_values("normalized_count", ascending=False)
+    linux = df.loc[df.os.eq("linux")].sort_values("normalized_count", ascending=False)
 
     mac_fig = px.line(
         mac,
@@ -43,7 +105,7 @@ def formula_installs(file: str) -> Dict[str, go.Figure]:
         color="formula",
         line_group="formula",
         labels={"n_days": "Last N Days", "normalized_count": "Installs per Day"},
-        title="Top 20 Mac Formula Installs",
+        title=f"Top {n} Mac Formula Installs",
     )
     mac_fig.update_layout(
         xaxis=dict(
@@ -61,7 +123,7 @@ def formula_installs(file: str) -> Dict[str, go.Figure]:
         color="formula",
         line_group="formula",
         labels={"n_days": "Last N Days", "normalized_count": "Installs per Day"},
-        title="Top 20 Linux Formula Installs",
+        title=f"Top {n} Linux Formula Installs",
     )
     linux_fig.update_layout(
         xaxis=dict(
@@ -77,178 +139,263 @@ def formula_installs(file: str) -> Dict[str, go.Figure]:
 
 def request_ratio(file: str) -> Dict[str, go.Figure]:
     """
-    request_ratio creates two barplots of the ratio of install on request: install
-    """
-    assert os.path.isfile(file), f"Could not find installs csv {file}"
-    df = pd.read_csv(file)
-    # Locate the top 20 packages by installs in the last 365 days
-    popular_packages = (
-        df.groupby("os")
-        .apply(
-            lambda x: x.loc[df.n_days.eq(365)]
-            .sort_values("count_regular", ascending=False)
-            .head(20)
-            .formula.tolist()
-        )
-        .to_dict()
-    )
+    request_ratio creates two barplots of the ratio of install on request: install,
+    from top_formulae.csv or formula_installs.csv
+    """
+    return plot_request_ratio(storage.read_frame(file))
 
-    smaller_df = df.loc[df.formula.isin(flatten(popular_packages.values()))]
 
-    figs = []
-    for which_os in popular_packages.keys():
+def plot_request_ratio(df: pd.DataFrame, n: int = 20) -> Dict[str, go.Figure]:
+    """
+    The figures of request_ratio for the top n formulae by installs in the last 365
+    days, from an already loaded top_n_table (see rankings.py), or table of formula
+    installs
+    """
+    top = rankings.ensure_table(df)
+
+    figs = dict()
+    for which_os in top.os.drop_duplicates():
+        popular = rankings.top_n(top, which_os, 365, "count_regular", n)
         fig = go.Figure(
             data=[
                 go.Bar(
-                    name="30 days",
-                    x=popular_packages[which_os],
-                    y=smaller_df.loc[
-                        smaller_df.formula.isin(popular_packages[which_os])
-                        & smaller_df.os.eq(which_os)
-                        & smaller_df.n_days.eq(30)
-                    ]
-                    .sort_values("count_regular", ascending=False)
-                    .pct_on_request,
-                ),
-                go.Bar(
-                    name="90 days",
-                    x=popular_packages[which_os],
-                    y=smaller_df.loc[
-                        smaller_df.formula.isin(popular_packages[which_os])
-                        & smaller_df.os.eq(which_os)
-                        & smaller_df.n_days.eq(90)
-                    ]
-                    .sort_values("count_regular", ascending=False)
-                    .pct_on_request,
-                ),
-                go.Bar(
-                    name="365 days",
-                    x=popular_packages[which_os],
-                    y=smaller_df.loc[
-                        smaller_df.formula.isin(popular_packages[which_os])
-                        & smaller_df.os.eq(which_os)
-                        & smaller_df.n_days.eq(365)
-                    ]
-                    .sort_values("count_regular", ascending=False)
-                    .pct_on_request,
-                ),
+                    name=f"{n_days} days",
+                    x=popular.formula.astype(str),
+                    y=popular[f"pct_on_request_{n_days}d"],
+                )
+                for n_days in [30, 90, 365]
             ]
         )
         fig.update_layout(
             barmode="group",
-            title=f"Top 20 Install on Request Ratio: {which_os}",
+            title=f"Top {n} Install on Request Ratio: {which_os}",
             yaxis_title="Percent of Installs on Request",
         )
-        figs.append(fig)
+        figs[which_os] = fig
+
+    return figs
+
+
+# The columns of graph_metrics.csv that can be charted, and their axis titles
+graph_metric_titles = {
+    "transitive_dependents": "Formulae Depending on It, Directly or Not",
+    "impact_installs": "Installs of It and Its Dependents, Last 365 Days",
+    "pagerank": "PageRank",
+    "transitive_dependencies": "Dependencies, Direct or Not",
+    "depth": "Longest Chain of Dependencies",
+}
+
+
+def graph_metrics(filename: str, metric: str, n: int = 20) -> go.Figure:
+    """
+    graph_metrics creates a barplot of the top n formulae by one of the metrics in
+    graph_metrics.csv
+    """
+    return plot_graph_metrics(storage.read_frame(filename), metric, n)
+
 
-    return dict(zip(popular_packages.keys(), figs))
+def plot_graph_metrics(df: pd.DataFrame, metric: str, n: int = 20) -> go.Figure:
+    """
+    The figure of graph_metrics, from an already loaded table of graph metrics
+    """
+    top = df.nlargest(n, metric)
+    fig = go.Figure(
+        data=[go.Bar(x=top.formula.astype(str), y=top[metric], name=metric)]
+    )
+    fig.update_layout(
+        title=f"Top {n} Formulae by {graph_metric_titles.get(metric, metric)}",
+        yaxis_title=graph_metric_titles.get(metric, metric),
+    )
+    return fig
 
 
 def flatten(collection):
     return it.chain.from_iterable(collection)
 
 
-def dep_matrix(filename: str) -> go.Figure:
+def dep_matrix(filename: str, n: int = 100) -> go.Figure:
     """
-    dep_matrix will create a heatmap of dependencies for the top 100
+    dep_matrix will create a heatmap of dependencies for the top n
     """
-    assert os.path.isfile(filename), f"Could not find file {filename}"
-    with open(filename) as fio:
-        deps = json.loads(fio.read())
-    df = pd.DataFrame(data=deps, columns=["package", "depends_on"])
+    return plot_dep_matrix(edge_store.read_graph(filename), n)
 
-    top100 = df.depends_on.value_counts().head(100).index.tolist()
-    mapping = dict(zip(top100, range(len(top100))))
 
-    smaller_df = df.loc[df.package.isin(top100) | df.depends_on.isin(top100)]
-
-    # Each row of the array is a package, each col is something it depends on
-    top100_dep_arr = np.zeros((100, 100))
-    for pair in smaller_df.itertuples():
-        if (pair.package in mapping) and (pair.depends_on in mapping):
-            top100_dep_arr[mapping[pair.package], mapping[pair.depends_on]] = 1
-    # Change 0 to None, this will stop it from being filled in during plotting
-    top100_dep_arr = np.where(top100_dep_arr == 1, top100_dep_arr, None)
+def plot_dep_matrix(
+    df: pd.DataFrame, n: int = 100, webgl_above: int = 300
+) -> go.Figure:
+    """
+    The heatmap of dep_matrix, from an already loaded table of package, depends_on
+    edges. For more than `webgl_above` packages, each dependency is drawn as a point of
+    a WebGL scatter instead, since a heatmap sends every empty cell to the browser too
+    """
+    top, rows, cols = dep_matrix_coords(df, n)
 
     fig = go.Figure()
-    fig.add_heatmap(x=top100, y=top100, z=top100_dep_arr, hoverongaps=False)
+    if len(top) <= webgl_above:
+        # NaN cells are left blank
+        z = np.full((len(top), len(top)), np.nan)
+        z[rows, cols] = 1
+        fig.add_heatmap(x=top, y=top, z=z, hoverongaps=False)
+        fig.update_traces(showscale=False)
+    else:
+        fig.add_scattergl(
+            x=np.asarray(top, dtype=object)[cols],
+            y=np.asarray(top, dtype=object)[rows],
+            mode="markers",
+            marker=dict(symbol="square", size=max(1, 600 // len(top))),
+            hovertemplate="%{y} depends on %{x}<extra></extra>",
+        )
     fig.update_layout(
-        title="Dependencies Among the Top 100 Most Depended Upon Packages<br>(hover to see which package depends on which other packages)",
+        title=f"Dependencies Among the Top {len(top)} Most Depended Upon Packages<br>(hover to see which package depends on which other packages)",
         yaxis_title="Package",
         xaxis_title="Depends On",
-        xaxis=dict(tickmode="array", tickvals=[], ticktext=[],),
-        yaxis=dict(tickmode="array", tickvals=[], ticktext=[],),
+        xaxis=dict(
+            tickmode="array",
+            tickvals=[],
+            ticktext=[],
+            categoryorder="array",
+            categoryarray=top,
+        ),
+        yaxis=dict(
+            tickmode="array",
+            tickvals=[],
+            ticktext=[],
+            categoryorder="array",
+            categoryarray=top,
+        ),
     )
-    fig.update_traces(showscale=False)
     return fig
 
 
-def create_dep_tree(filename: str, formula: str) -> go.Figure:
+def dep_matrix_coords(
+    df: pd.DataFrame, n: int
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    The n most depended upon packages, most first, and for every distinct edge between
+    two of them, the position of its package (row) and of what it depends on (column)
+    in that list. Done with integer codes rather than an edge at a time, so it stays
+    quick for thousands of packages
+    """
+    # Both columns need to share one category dictionary to compare their codes
+    if not (
+        isinstance(df.package.dtype, pd.CategoricalDtype)
+        and df.package.dtype == df.depends_on.dtype
+    ):
+        df = schema.apply_schema(df[["package", "depends_on"]])
+
+    counts = df.depends_on.value_counts()
+    top = counts[counts > 0].head(n).index.tolist()
+
+    # Position in `top` of every category, or -1 for the ones not in it
+    position = np.full(len(df.depends_on.cat.categories), -1)
+    position[df.depends_on.cat.categories.get_indexer(top)] = np.arange(len(top))
+    rows = position[df.package.cat.codes.to_numpy()]
+    cols = position[df.depends_on.cat.codes.to_numpy()]
+
+    # Keep edges between two of the top packages, each once
+    inside = (rows >= 0) & (cols >= 0)
+    cells = np.unique(rows[inside] * len(top) + cols[inside])
+    return top, cells // len(top), cells % len(top)
+
+
+def create_dep_tree(filename: str, formula: str, dag: bool = False) -> go.Figure:
     """
     Create a tree figure of what formulas one formula depends on
     """
-    assert os.path.isfile(filename), f"Could not find file {filename}"
-    with open(filename) as fio:
-        deps = json.loads(fio.read())
-    df = pd.DataFrame(data=deps, columns=["package", "depends_on"])
+    adjacency = edge_adjacency(edge_store.read_graph(filename))
 
-    assert formula in set(df.package).union(
-        df.depends_on
+    assert formula in set(adjacency).union(
+        flatten(adjacency.values())
     ), f"Package asked for ({formula}) does not exist"
 
-    requirements_list = build_requirements_list(df, formula)
-    nodes_df = get_pprint_version_df(requirements_list)
-
-    # Create a df of edges    
-    # Iterate over items in nodes_df. For each, get df.depends_on.loc[df.package.eq(formula_i)]
-    # Create pairs of formula_i -> dep
-    # Match pairs with (x,y) locations
+    return plot_dep_tree(adjacency, formula, dag=dag)
 
 
-    fig = px.scatter(nodes_df, x="x", y="y", text="text", title="Dependency Tree")
-    # fig.update_traces(line_shape="vh")
-    return fig
+def load_dep_closure(filename: str) -> Dict[str, dict]:
+    """
+    Read the precomputed dependency closure written by get_and_clean_data
+    """
+    assert os.path.isfile(filename), f"Could not find file {filename}"
+    with open(filename) as fio:
+        return json.loads(fio.read())
 
 
-def get_pprint_version_df(l: list) -> pd.DataFrame:
+def create_dep_tree_from_closure(
+    closure: Dict[str, dict], formula: str, dag: bool = False
+) -> go.Figure:
     """
-    Get what pprint spits out as a string, put into dataframe of cartesian coorinates
+    Create the same tree figure as create_dep_tree, but from an already loaded
+    dependency closure, so nothing is read from disk or recomputed
     """
-    stream = StringIO()
-    # Capture the beauty of pprint in a string
-    pprint(l, indent=2, stream=stream)
-    s = stream.getvalue().splitlines()
+    assert formula in closure, f"Package asked for ({formula}) does not exist"
 
-    # Clean up the data in the stream
-    cleaner_strings = [
-        si.replace("[", "").replace("]", "").replace("'", "").replace(",", "").rstrip()
-        for si in s
-    ]
+    adjacency = {f: closure[f]["dependencies"] for f in closure[formula]["transitive"]}
+    adjacency[formula] = closure[formula]["dependencies"]
 
-    return pd.DataFrame(
-        [
-            dict(x=count_starting_spaces(line), y=-height, text=line)
-            for height, line in enumerate(cleaner_strings)
-        ]
+    info = closure[formula]
+    title = (
+        f"Dependency Tree<br>{len(info['transitive'])} dependencies, "
+        f"depth {info['depth']}, {len(info['dependents'])} formulas depend on it"
     )
+    return plot_dep_tree(adjacency, formula, title, dag=dag)
 
 
-def count_starting_spaces(line: str) -> int:
-    "Count the number of spaces at the start of the string"
-    return len(re.findall(r"^(\s*)", line)[0])
+def plot_dep_tree(
+    adjacency: Dict[str, List[str]],
+    formula: str,
+    title: str = "Dependency Tree",
+    dag: bool = False,
+) -> go.Figure:
+    """
+    Lay out and plot the tree of dependencies below `formula`, as one trace of edges
+    and one trace of labelled nodes. With dag=True, shared dependencies are drawn once
+    """
+    layout = tree_layout.layout_tree(adjacency, formula, dag=dag)
+
+    fig = go.Figure()
+    fig.add_scatter(
+        x=layout.edge_x,
+        y=layout.edge_y,
+        mode="lines",
+        line=dict(width=1, color="lightgray"),
+        hoverinfo="skip",
+        showlegend=False,
+    )
+    fig.add_scatter(
+        x=layout.node_x,
+        y=layout.node_y,
+        mode="markers+text",
+        text=layout.node_text,
+        textposition="middle right",
+        hoverinfo="text",
+        showlegend=False,
+    )
+    fig.update_layout(
+        title=title,
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+    )
+    return fig
 
 
-def build_requirements_list(df: pd.DataFrame, formula: str) -> list:
+def edge_adjacency(edges: pd.DataFrame) -> Dict[str, List[str]]:
     """
-    Recursively get the dependencies for a formula
+    What each package directly depends on, from a table of package, depends_on
+    categoricals sharing their categories, e.g. from edge_store.read_graph. The edges
+    are grouped by their integer codes, and each name is only looked up once per list
     """
-    return [
-        formula,
-        [
-            build_requirements_list(df, li)
-            for li in df.depends_on.loc[df.package.eq(formula)]
-        ],
-    ]
+    src = edges.package.cat.codes.to_numpy()
+    dst = edges.depends_on.cat.codes.to_numpy()
+    names = np.asarray(edges.package.cat.categories, dtype=object)
+
+    order = np.argsort(src, kind="stable")
+    packages, starts = np.unique(src[order], return_index=True)
+    deps = names[dst[order]].tolist()
+    bounds = starts.tolist() + [len(deps)]
+    return {
+        package: deps[lo:hi]
+        for package, lo, hi in zip(names[packages].tolist(), bounds[:-1], bounds[1:])
+    }
 
 
 # Look here for instructions to build a chord diagram
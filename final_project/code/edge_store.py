@@ -0,0 +1,159 @@
+"""
+Every kind of dependency graph in one typed store: int32 package and depends_on ids
+into a single sorted table of names, and a uint8 kind for each edge. It is built in one
+pass over the formula catalog, and saved like storage.py's columnar tables, as .npy
+files that are memory mapped rather than parsed. The JSON edge lists the pipeline has
+always written are derived from it
+"""
+import json
+import os
+from array import array
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+import schema
+import storage
+
+# The keys of the formula catalog holding each kind of edge, in the order of their codes
+KINDS = [
+    "dependencies",
+    "recommended_dependencies",
+    "optional_dependencies",
+    "requirements",
+]
+
+# The JSON file each kind of edge is also saved as
+GRAPH_FILES = {
+    "dependencies": "dep_graph.json",
+    "recommended_dependencies": "recommended_dependencies_graph.json",
+    "optional_dependencies": "optional_dependencies_graph.json",
+    "requirements": "requirements_graph.json",
+}
+
+# Where the store is saved in the data folder, as storage.columnar_path(store_name)
+store_name = "edges"
+
+
+class EdgeStore(NamedTuple):
+    """
+    Edges as parallel arrays. src and dst are positions in names, and kind is a
+    position in KINDS. A requirement isn't a formula but a dict, such as
+    {"name": "xcode", "version": "11.4", ...}, and is named by its JSON
+    """
+
+    names: List[str]
+    src: np.ndarray
+    dst: np.ndarray
+    kind: np.ndarray
+
+
+def build(formula_json: List[dict]) -> EdgeStore:
+    """
+    The edges of every kind, from one pass over the formula catalog. They come in the
+    catalog's order, so each kind's edges are in the order create_dependencies_graph
+    would list them
+    """
+    ids = dict()
+    src, dst, kind = array("i"), array("i"), array("B")
+    for formula in formula_json:
+        # Formulae whose data couldn't be read are empty
+        if "name" not in formula:
+            continue
+        package = ids.setdefault(formula["name"], len(ids))
+        for code, key in enumerate(KINDS):
+            for dep in formula.get(key, []):
+                if not isinstance(dep, str):
+                    dep = json.dumps(dep)
+                src.append(package)
+                dst.append(ids.setdefault(dep, len(ids)))
+                kind.append(code)
+
+    # Renumber the names in sorted order, the same order schema.name_dtype uses
+    names = sorted(ids)
+    new_id = np.empty(len(names), dtype=np.int32)
+    new_id[[ids[name] for name in names]] = np.arange(len(names), dtype=np.int32)
+    return EdgeStore(
+        names,
+        new_id[np.frombuffer(src, dtype=np.int32)],
+        new_id[np.frombuffer(dst, dtype=np.int32)],
+        np.frombuffer(kind, dtype=np.uint8).copy(),
+    )
+
+
+def save(store: EdgeStore, filename: str):
+    """
+    Save the store in the folder storage.columnar_path(filename). Its schema.json is
+    storage.py's, so storage.read_columnar can read the id columns too
+    """
+    columns = [
+        dict(name=c, dtype=str(getattr(store, c).dtype)) for c in ["src", "dst", "kind"]
+    ]
+    with storage.folder_replacement(storage.columnar_path(filename)) as directory:
+        for column in ["src", "dst", "kind"]:
+            np.save(os.path.join(directory, f"{column}.npy"), getattr(store, column))
+        with open(os.path.join(directory, "names.json"), "w") as f:
+            f.write(json.dumps(store.names))
+        with open(os.path.join(directory, "schema.json"), "w") as f:
+            f.write(json.dumps(dict(rows=len(store.src), columns=columns, kinds=KINDS)))
+
+
+def load(filename: str) -> EdgeStore:
+    """
+    Read the store saved by save(filename), memory mapping the ids
+    """
+    directory = storage.columnar_path(filename)
+    with open(os.path.join(directory, "names.json")) as f:
+        names = json.loads(f.read())
+    src, dst, kind = [
+        np.load(os.path.join(directory, f"{c}.npy"), mmap_mode="r")
+        for c in ["src", "dst", "kind"]
+    ]
+    return EdgeStore(names, src, dst, kind)
+
+
+def edge_frame(store: EdgeStore, kind: str = "dependencies") -> pd.DataFrame:
+    """
+    The package, depends_on edges of one kind, as categoricals made straight from
+    the ids, sharing the store's table of names
+    """
+    names = pd.CategoricalDtype(store.names)
+    of_kind = np.asarray(store.kind) == KINDS.index(kind)
+    return pd.DataFrame(
+        {
+            column: pd.Categorical.from_codes(np.asarray(ids)[of_kind], dtype=names)
+            for column, ids in zip(storage.EDGE_COLUMNS, [store.src, store.dst])
+        }
+    )
+
+
+def edge_list(store: EdgeStore, kind: str = "dependencies") -> List[Tuple[str, str]]:
+    """
+    The edges of one kind as (package, depends_on) names, as create_dependencies_graph
+    makes them, and as they are saved in the JSON files
+    """
+    of_kind = np.asarray(store.kind) == KINDS.index(kind)
+    names = np.array(store.names, dtype=object)
+    packages = names[np.asarray(store.src)[of_kind]].tolist()
+    deps = names[np.asarray(store.dst)[of_kind]].tolist()
+    if kind == "requirements":
+        deps = [json.loads(d) for d in deps]
+    return list(zip(packages, deps))
+
+
+def read_graph(filename: str) -> pd.DataFrame:
+    """
+    Read one of the GRAPH_FILES, from the edge store in the same folder if there is
+    one at least as new as the JSON file, and from the JSON file otherwise
+    """
+    directory, name = os.path.split(filename)
+    kind = {file: kind for kind, file in GRAPH_FILES.items()}.get(name)
+    store_file = os.path.join(directory, store_name)
+    if kind is not None and storage.has_columnar(store_file):
+        saved = os.path.getmtime(
+            os.path.join(storage.columnar_path(store_file), "schema.json")
+        )
+        if not os.path.isfile(filename) or saved >= os.path.getmtime(filename):
+            return schema.apply_schema(edge_frame(load(store_file), kind))
+    return storage.read_frame(filename)
@@ -0,0 +1,86 @@
+"""
+A bounded, in-memory cache of figures for the app's callbacks. Figures are kept as the
+compact JSON sent to the browser (see figure_payload.py), so a hit skips building the
+figure and its plotly objects altogether, and the cache's size is simply the length of
+that JSON
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import plotly.graph_objects as go
+import plotly.utils
+
+import figure_payload
+
+
+class FigureCache:
+    """
+    Keeps figures under keys like (callback, arguments, data version), evicting the
+    least recently used ones once their JSON adds up to more than max_bytes
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.size = 0
+        self.stats = dict(hits=0, misses=0, evictions=0)
+        # Callbacks run on several threads
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], go.Figure]):
+        """
+        The figure for `key`, as a dict ready to return from a callback. If it isn't
+        cached, build() makes it and it is added to the cache
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return json.loads(self.entries[key])
+
+        # Built outside the lock, so a slow figure doesn't hold up the others
+        figure = figure_payload.compact(build())
+        serialized = json.dumps(
+            figure, cls=plotly.utils.PlotlyJSONEncoder, separators=(",", ":")
+        )
+        with self.lock:
+            self.stats["misses"] += 1
+            self.put(key, serialized)
+        return figure
+
+    def put(self, key: Hashable, serialized: str):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        # A figure bigger than the whole cache is not kept at all
+        if len(serialized) > self.max_bytes:
+            return
+        self.entries[key] = serialized
+        self.size += len(serialized)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups that were answered from the cache
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        if lookups == 0:
+            return 0.0
+        return self.stats["hits"] / lookups
+
+    def report(self) -> dict:
+        """
+        The counters and current size, to help pick max_bytes
+        """
+        with self.lock:
+            return dict(
+                self.stats,
+                hit_rate=self.hit_rate(),
+                entries=len(self.entries),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+            )
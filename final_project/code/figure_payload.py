@@ -0,0 +1,127 @@
+"""
+Figures as small payloads for the browser. Numbers in a figure's traces are sent as
+plotly.js typed arrays, base64 encoded binary in the narrowest type that holds them
+exactly, rather than as long JSON lists of decimals. Several variants of one chart,
+e.g. one per OS, can be sent together with their template only once, for the browser
+to switch between without asking the server
+"""
+import base64
+from typing import Any, Dict, Union
+
+import numpy as np
+import plotly.graph_objects as go
+
+# The integer types plotly.js reads, narrowest first. It has no 64 bit integers
+int_types = ["i1", "u1", "i2", "u2", "i4", "u4"]
+
+
+def typed_array(values: Union[np.ndarray, list, dict]) -> Union[dict, Any]:
+    """
+    values as a plotly.js typed array, {"dtype": ..., "bdata": ...}, and a "shape" if
+    it has two dimensions. Integers, and floats that are all whole numbers, use the
+    smallest integer type they fit, and other floats use float32 if it holds them
+    exactly. values that aren't numbers are returned as they are
+    """
+    if isinstance(values, dict):
+        # Already typed, e.g. by plotly 6 or newer, which always uses float64
+        if "bdata" not in values or values.get("dtype") not in ["f4", "f8"]:
+            return values
+        values = np.frombuffer(
+            base64.b64decode(values["bdata"]), dtype=values["dtype"]
+        ).reshape(
+            [int(n) for n in values["shape"].split(",")] if "shape" in values else -1
+        )
+
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        # Ragged lists of lists
+        return values
+    if array.size == 0 or array.ndim > 2 or array.dtype.kind not in "iuf":
+        return values
+
+    if array.dtype.kind == "f" and np.isfinite(array).all():
+        whole = array.astype(np.int64)
+        if np.array_equal(whole, array):
+            array = whole
+    if array.dtype.kind in "iu":
+        low, high = array.min(), array.max()
+        dtype = next(
+            (
+                t
+                for t in int_types
+                if np.iinfo(t).min <= low and high <= np.iinfo(t).max
+            ),
+            "f8",
+        )
+    else:
+        narrow = array.astype("f4")
+        dtype = "f4" if np.array_equal(narrow, array, equal_nan=True) else "f8"
+
+    typed = dict(
+        dtype=dtype,
+        bdata=base64.b64encode(np.ascontiguousarray(array, dtype=dtype)).decode(),
+    )
+    if array.ndim == 2:
+        typed["shape"] = f"{array.shape[0]},{array.shape[1]}"
+    return typed
+
+
+def compact_trace(trace: dict) -> dict:
+    """
+    A trace with every list of numbers in it, including those in nested attributes
+    such as marker.color, as a typed array
+    """
+    compact = dict()
+    for key, value in trace.items():
+        if key == "type":
+            compact[key] = value
+        elif isinstance(value, dict) and "bdata" not in value:
+            compact[key] = compact_trace(value)
+        elif isinstance(value, (list, tuple, np.ndarray, dict)):
+            compact[key] = typed_array(value)
+        else:
+            compact[key] = value
+    return compact
+
+
+def compact(figure: Union[go.Figure, dict]) -> dict:
+    """
+    The figure as a dict ready to send to the browser, with its traces' numbers as
+    typed arrays
+    """
+    if isinstance(figure, go.Figure):
+        figure = figure.to_plotly_json()
+    return dict(figure, data=[compact_trace(trace) for trace in figure["data"]])
+
+
+def variants(figures: Dict[str, Union[go.Figure, dict]]) -> dict:
+    """
+    Several figures, e.g. one per OS, as {"template": ..., "figures": {name: figure}},
+    for a dcc.Store. They are usually drawn with the same template, which is sent once
+    here instead of in every figure, and put back by with_template in the browser
+    """
+    figures = {name: compact(figure) for name, figure in figures.items()}
+    templates = [figure["layout"].get("template") for figure in figures.values()]
+    template = templates[0] if templates else None
+    if any(t != template for t in templates):
+        # Nothing to share
+        return dict(template=None, figures=figures)
+
+    for name, figure in figures.items():
+        layout = {k: v for k, v in figure["layout"].items() if k != "template"}
+        figures[name] = dict(figure, layout=layout)
+    return dict(template=template, figures=figures)
+
+
+# Returns the figure `name` of a variants() store, with the shared template back in its
+# layout. Run in the browser by a clientside callback
+with_template = """
+function(name, store) {
+    const figure = store.figures[name];
+    if (!figure || !store.template) {
+        return figure;
+    }
+    return {...figure, layout: {...figure.layout, template: store.template}};
+}
+"""
@@ -2,117 +2,364 @@ from urllib import request
 from urllib.error import HTTPError
 import json
 import itertools
-from typing import Dict, Iterable, List, Tuple
+import io
+from array import array
+from typing import IO, Callable, Dict, Iterable, List, Tuple
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from warnings import warn
-from multiprocessing import Pool
+import argparse
 import os
 import re
+import time
+from datetime import date
 
+import numpy as np
 import pandas as pd
-from graphviz import Digraph
-
-
-def main():
+import graphviz
+
+import async_fetch
+import edge_store
+import graph_analytics
+import graph_export
+import history
+import rankings
+import graph_order
+import http_cache
+import instrument
+import json_stream
+import pipeline
+import schema
+import storage
+
+
+def main(targets: List[str] = None, workers: int = None, force: bool = False):
     """
     The main functionality of this script. Written here in a function for ease of
-    calling from other scripts
+    calling from other scripts. Runs the stages in targets (see pipeline_stages), and
+    the stages they need, or every stage. Stages that are up to date are skipped,
+    unless force is set
     """
-    from time import time
-
-    start_time = time()
-
-    # Build dataframes from the json data at the URLs listed above
-    dfs = [build_df_from_items(get_response(url)) for url in install_and_error_urls]
-
-    # From all the formulas in `dfs`, get a list of the unique ones
-    formulas_with_args = get_unique_formulas(dfs)
-
-    # Many of the formulas have arguments with them. Get just the name of the formula
-    bare_formulas = set(f.split()[0] for f in formulas_with_args)
+    start_time = time.perf_counter()
 
-    # If data exists in a data folder, get it. If not, get the data from the internet
     this_dir = os.path.dirname(__file__)
     data_dir = os.path.join(this_dir, "..", "data")
-    all_package_data_file = os.path.join(data_dir, "formula_info.json")
-    if os.path.isfile(all_package_data_file):
-        with open(all_package_data_file) as f:
-            formula_json = json.loads(f.read())
-    else:
-        # For each formula, try to get it's json data. There are probably a few thousand, so
-        # this may take a few minutes
-        formula_json = get_available_formula_json_parallel(bare_formulas)
-
-        # Save off the data so I don't have to get it every time I test the script
-        json_cache(formula_json, all_package_data_file)
-        # with open(all_package_data_file, "w") as f:
-        #     f.write(json.dumps(formula_json))
 
-    # Count the number of times a formula is used as a dependency
-    depended_upon_formulae = Counter(
-        itertools.chain.from_iterable(f.get("dependencies", []) for f in formula_json)
-    )
-    depended_upon_formulae = pd.DataFrame(
-        depended_upon_formulae.items(), columns=["formula", "count"]
-    ).sort_values("count", ascending=False)
-    depended_upon_formulae.to_csv(
-        os.path.join(data_dir, "depended_upon_formulae.csv"), index=False
+    # Keep a copy of every response, and only download it again once it has changed
+    cache = http_cache.ResponseCache(
+        os.path.join(data_dir, "http_cache"),
+        default_ttl=response_ttl,
+        max_bytes=response_cache_max_bytes,
+        max_age=response_cache_max_age,
     )
 
-    # Get a list of dicts mapping a package to one of its dependencies
-    dep_graph = create_dependencies_graph(formula_json, "dependencies")
-    json_cache(dep_graph, os.path.join(data_dir, "dep_graph.json"))
+    # Time each stage, and count what it reads, writes and downloads
+    report = instrument.RunReport(cache)
+
+    # Run the stages, side by side where they don't need each other
+    pipeline.run(
+        pipeline_stages(data_dir, cache),
+        data_dir,
+        report,
+        targets,
+        pipeline_workers if workers is None else workers,
+        force,
+    )
 
-    # Create an empty digraph object, and fill it with connected edges
-    dot = Digraph(name="dependency graph")
-    for d in dep_graph:
-        dot.edge(*d)
+    # Save what each stage took, to find the one to blame when a refresh slows down
+    report.write_json(os.path.join(data_dir, "run_report.json"))
+    if prometheus_output:
+        report.write_prometheus(os.path.join(data_dir, "run_report.prom"))
 
-    # Save the digraph to a file if it doesn't already exist
-    dep_graph_filename = os.path.join(this_dir, "..", "plots", "dep_graph.gv")
-    if os.path.isfile(dep_graph_filename) is False:
-        dot.render(dep_graph_filename, view=True)
+    run_time = time.perf_counter() - start_time
+    print(report.summary())
+    print(f"get_and_clean_data.py -- {run_time:.2f}s")
+    print(f"http cache -- {cache.stats}, hit rate {cache.hit_rate():.0%}")
 
-    # Get a list of dicts mapping a package to one of its recommended dependencies
-    rec_dep_graph = create_dependencies_graph(formula_json, "recommended_dependencies")
-    json_cache(
-        rec_dep_graph, os.path.join(data_dir, "recommended_dependencies_graph.json")
-    )
 
-    # Get a list of dicts mapping a package to one of its optional dependencies
-    opt_dep_graph = create_dependencies_graph(formula_json, "optional_dependencies")
-    json_cache(
-        opt_dep_graph, os.path.join(data_dir, "optional_dependencies_graph.json")
-    )
+def pipeline_stages(
+    data_dir: str, cache: http_cache.ResponseCache = None
+) -> List[pipeline.Stage]:
+    """
+    Every stage of the data step, with the stages it needs and the files it writes in
+    data_dir. Each stage is given its record in the run report and the results of the
+    stages it needs, and returns its own result
+    """
 
-    # Get a list of dicts mapping a package to one of its requirements
-    req_dep_graph = create_dependencies_graph(formula_json, "requirements")
-    json_cache(req_dep_graph, os.path.join(data_dir, "requirements_graph.json"))
+    def path(name: str) -> str:
+        return os.path.join(data_dir, name)
+
+    # The day the history snapshots are saved for, the same for the whole run
+    today = date.today()
+
+    def read_json(name: str):
+        with open(path(name)) as f:
+            return json.loads(f.read())
+
+    # Build dataframes from the json data at the URLs listed below. The downloads run
+    # concurrently, and each dataframe is built as soon as its download finishes
+    def analytics_download(stage: dict) -> Dict[str, pd.DataFrame]:
+        data_dict = get_analytics_dfs(install_and_error_urls, cache)
+        stage["rows_out"] = sum(len(df) for df in data_dict.values())
+        return data_dict
+
+    # If recent data exists in a data folder, get it. If not, get it from the internet
+    def formula_fetch(stage: dict, data_dict: Dict[str, pd.DataFrame]) -> List[dict]:
+        # From all the formulas in the analytics, get a list of the unique ones
+        formulas_with_args = get_unique_formulas(list(data_dict.values()))
+
+        # Many of the formulas have arguments with them. Get just the name of the formula
+        bare_formulas = set(f.split()[0] for f in formulas_with_args)
+        stage["rows_in"] = len(bare_formulas)
+
+        all_package_data_file = path("formula_info.json")
+        if file_is_fresh(all_package_data_file, formula_info_max_age):
+            formula_json = read_json("formula_info.json")
+        else:
+            # Read every formula out of homebrew's single catalog document. If that
+            # doesn't work, fall back to getting each formula's json data one at a
+            # time. There are probably a few thousand, so that may take a few minutes
+            try:
+                formula_json = get_formula_json_bulk(bare_formulas, cache=cache)
+            except Exception as e:
+                warn(
+                    f"Could not read the formula catalog ({e}), fetching one at a time"
+                )
+                formula_json = get_available_formula_json_parallel(bare_formulas)
+                stage["http_requests"] += len(bare_formulas)
+
+            # Save off the data so I don't have to get it every time I test the script
+            json_cache(formula_json, all_package_data_file, formula_info_max_age)
+        stage["rows_out"] = len(formula_json)
+        return formula_json
 
-    # Create dict of url: df
-    data_dict = dict(zip(install_and_error_urls, dfs))
+    # Count the number of times a formula is used as a dependency
+    def dependency_counts(stage: dict, formula_json: List[dict]) -> pd.DataFrame:
+        stage["rows_in"] = len(formula_json)
+        depended_upon_formulae = Counter(
+            itertools.chain.from_iterable(
+                f.get("dependencies", []) for f in formula_json
+            )
+        )
+        depended_upon_formulae = schema.apply_schema(
+            pd.DataFrame(
+                depended_upon_formulae.items(), columns=["formula", "count"]
+            ).sort_values("count", ascending=False)
+        )
+        save_table(depended_upon_formulae, path("depended_upon_formulae.csv"))
+        stage["rows_out"] = len(depended_upon_formulae)
+        return depended_upon_formulae
+
+    # Every kind of dependency as integer ids into one table of names, in one pass, and
+    # each kind as a JSON list of edges. The store is saved after the JSON files, as the
+    # app only reads a graph from it if it is at least as new
+    def build_edge_store(stage: dict, formula_json: List[dict]) -> edge_store.EdgeStore:
+        stage["rows_in"] = len(formula_json)
+        edges = edge_store.build(formula_json)
+        for kind, filename in edge_store.GRAPH_FILES.items():
+            save_graph(edge_store.edge_list(edges, kind), path(filename))
+        edge_store.save(edges, path(edge_store.store_name))
+        stage["rows_out"] = len(edges.src)
+        return edges
+
+    # Get a list of tuples mapping a package to one of its dependencies
+    def dep_graph(stage: dict, edges: edge_store.EdgeStore) -> List[tuple]:
+        stage["rows_in"] = len(edges.src)
+        edge_list = edge_store.edge_list(edges, "dependencies")
+        stage["rows_out"] = len(edge_list)
+        return edge_list
+
+    # Precompute the transitive dependencies and dependents of every formula, so the
+    # app can look them up instead of walking the graph on every request
+    def dep_closure(stage: dict, dep_graph: List[tuple]) -> Dict[str, dict]:
+        stage["rows_in"] = len(dep_graph)
+        closure = create_dependency_closure(dep_graph)
+        save_json(closure, path("dep_closure.json"))
+        stage["rows_out"] = len(closure)
+        return closure
 
     # Get all formula install events into a single df with columns:
     # formula, count, pct_on_request, percent, os, n_days
-    formula_installs = create_formula_install_df(data_dict)
-    formula_installs.to_csv(os.path.join(data_dir, "formula_installs.csv"), index=False)
+    def formula_installs(
+        stage: dict, data_dict: Dict[str, pd.DataFrame]
+    ) -> pd.DataFrame:
+        stage["rows_in"] = sum(
+            len(df)
+            for url, df in data_dict.items()
+            if parse_analytics_url(url)["event"] in install_metrics
+        )
+        installs = create_formula_install_df(data_dict)
+        save_table(installs, path("formula_installs.csv"))
+        stage["rows_out"] = len(installs)
+        return installs
+
+    # The top formulae of each OS, window and metric, ranked once here rather than on
+    # every draw of the install charts
+    def top_formulae(stage: dict, installs: pd.DataFrame) -> pd.DataFrame:
+        stage["rows_in"] = len(installs)
+        top = rankings.top_n_table(installs)
+        save_table(top, path("top_formulae.csv"))
+        stage["rows_out"] = len(top)
+        return top
+
+    # Blast radius, PageRank, depth and install impact of every formula in the graph
+    def graph_metrics(
+        stage: dict, dep_graph: List[tuple], installs: pd.DataFrame
+    ) -> pd.DataFrame:
+        stage["rows_in"] = len(dep_graph)
+        metrics = graph_analytics.graph_metrics(
+            pd.DataFrame(dep_graph, columns=storage.EDGE_COLUMNS), installs
+        )
+        save_table(metrics, path("graph_metrics.csv"))
+        stage["rows_out"] = len(metrics)
+        return metrics
+
+    # Draw the neighborhoods of the most central formulae, rather than the whole graph.
+    # Layouts are cached, so this only takes long when the graph has changed
+    def graphviz_render(
+        stage: dict, edges: edge_store.EdgeStore, metrics: pd.DataFrame
+    ) -> List[str]:
+        stage["rows_in"] = ego_graphs_top_n
+        try:
+            drawn = graph_export.export(
+                edge_store.edge_frame(edges, "dependencies"),
+                graph_export.top_formulae(metrics, ego_graphs_top_n),
+            )
+        except graphviz.ExecutableNotFound:
+            warn("Graphviz isn't installed, so no dependency graphs were drawn")
+            return []
+        stage["rows_out"] = len(drawn)
+        return drawn
 
     # Get all cask install information
-    cask_installs = create_cask_install_df(data_dict)
-    cask_installs.to_csv(os.path.join(data_dir, "cask_installs.csv"), index=False)
+    def cask_installs(stage: dict, data_dict: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        stage["rows_in"] = sum(
+            len(df) for url, df in data_dict.items() if "cask" in url
+        )
+        casks = create_cask_install_df(data_dict)
+        save_table(casks, path("cask_installs.csv"))
+        stage["rows_out"] = len(casks)
+        return casks
 
     # Get all the build error information
-    build_errors = create_build_errors_df(data_dict)
-    build_errors.to_csv(os.path.join(data_dir, "build_errors.csv"), index=False)
-
-    run_time = time() - start_time
-    print(f"get_and_clean_data.py -- {run_time:.2f}s")
+    def build_errors(stage: dict, data_dict: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        stage["rows_in"] = sum(
+            len(df) for url, df in data_dict.items() if "build-error" in url
+        )
+        errors = create_build_errors_df(data_dict)
+        save_table(errors, path("build_errors.csv"))
+        stage["rows_out"] = len(errors)
+        return errors
+
+    # Keep a dated copy of the analytics, since homebrew only publishes rolling totals
+    def add_history(stage: dict, *tables: pd.DataFrame) -> List[str]:
+        stage["rows_in"] = sum(len(df) for df in tables)
+        names = ["formula_installs", "cask_installs", "build_errors"]
+        snapshots = [
+            history.append_snapshot(df, path("history"), name, today)
+            for name, df in zip(names, tables)
+        ]
+        stage["rows_out"] = stage["rows_in"]
+        return snapshots
+
+    def table(name: str) -> Callable[[], pd.DataFrame]:
+        return lambda: storage.read_frame(path(name))
+
+    stages = [
+        pipeline.Stage(
+            "analytics_download", analytics_download, params=(install_and_error_urls,)
+        ),
+        pipeline.Stage(
+            "formula_fetch",
+            formula_fetch,
+            ["analytics_download"],
+            ["formula_info.json"],
+            lambda: read_json("formula_info.json"),
+            max_age=formula_info_max_age,
+        ),
+        pipeline.Stage(
+            "dependency_counts",
+            dependency_counts,
+            ["formula_fetch"],
+            ["depended_upon_formulae.csv"],
+        ),
+        pipeline.Stage(
+            "edge_store",
+            build_edge_store,
+            ["formula_fetch"],
+            list(edge_store.GRAPH_FILES.values())
+            + [storage.columnar_path(edge_store.store_name)],
+            lambda: edge_store.load(path(edge_store.store_name)),
+        ),
+        pipeline.Stage("dep_graph", dep_graph, ["edge_store"]),
+        pipeline.Stage("dep_closure", dep_closure, ["dep_graph"], ["dep_closure.json"]),
+        pipeline.Stage(
+            "formula_installs",
+            formula_installs,
+            ["analytics_download"],
+            ["formula_installs.csv"],
+            table("formula_installs.csv"),
+        ),
+        pipeline.Stage(
+            "top_formulae",
+            top_formulae,
+            ["formula_installs"],
+            ["top_formulae.csv"],
+            params=(rankings.max_rank,),
+        ),
+        pipeline.Stage(
+            "graph_metrics",
+            graph_metrics,
+            ["dep_graph", "formula_installs"],
+            ["graph_metrics.csv"],
+            table("graph_metrics.csv"),
+        ),
+        pipeline.Stage(
+            "graphviz_render",
+            graphviz_render,
+            ["edge_store", "graph_metrics"],
+            [graph_export.export_dir],
+            params=(ego_graphs_top_n,),
+        ),
+        pipeline.Stage(
+            "cask_installs",
+            cask_installs,
+            ["analytics_download"],
+            ["cask_installs.csv"],
+            table("cask_installs.csv"),
+        ),
+        pipeline.Stage(
+            "build_errors",
+            build_errors,
+            ["analytics_download"],
+            ["build_errors.csv"],
+            table("build_errors.csv"),
+        ),
+    ]
+    if history_output:
+        # A snapshot a day, even when the analytics haven't changed
+        stages.append(
+            pipeline.Stage(
+                "history",
+                add_history,
+                ["formula_installs", "cask_installs", "build_errors"],
+                ["history"],
+                params=(today.isoformat(),),
+            )
+        )
+    return stages
 
 
-def get_response(url: str) -> dict:
+def get_response(
+    url: str, cache: http_cache.ResponseCache = None, ttl: float = None
+) -> dict:
     """
-    Get a dict from a JSON API
+    Get a dict from a JSON API. If a cache is given, the response is read from it
+    while it is up to date, and revalidated with the server once it isn't
     """
+    if cache is not None:
+        return json.loads(cache.fetch(url, ttl))
+
     json_data = dict()
 
     oper_url = request.urlopen(url, timeout=1)
@@ -124,6 +371,49 @@ def get_response(url: str) -> dict:
     return json_data
 
 
+def get_analytics_dfs(
+    urls: List[str],
+    cache: http_cache.ResponseCache = None,
+    max_downloads: int = 8,
+    max_parsers: int = 4,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Download the json at every url concurrently, and hand each response to a pool of
+    parsers as soon as it arrives, to build its dataframe with
+    build_df_from_items_stream().
+    Returns a dict of url: df in the same order as `urls`, where the formula/cask
+    columns of every df share one category dictionary
+    """
+    with ThreadPoolExecutor(max_downloads) as downloaders, ThreadPoolExecutor(
+        max_parsers
+    ) as parsers:
+        downloads = {
+            downloaders.submit(get_response_body, url, cache): url for url in urls
+        }
+        # Forget each download once its body is handed over, so bodies are freed as
+        # soon as they are parsed rather than all held until the end
+        parsed = {
+            downloads.pop(d): parsers.submit(
+                lambda body: build_df_from_items_stream(io.BytesIO(body)), d.result()
+            )
+            for d in as_completed(list(downloads))
+        }
+        dfs = {url: parsed[url].result() for url in urls}
+
+    names = schema.name_dtype(*(schema.frame_names(df) for df in dfs.values()))
+    return {url: schema.apply_schema(df, names) for url, df in dfs.items()}
+
+
+def get_response_body(url: str, cache: http_cache.ResponseCache = None) -> bytes:
+    """
+    Get the raw body of a response, through the cache if one is given
+    """
+    if cache is not None:
+        return cache.fetch(url)
+    with request.urlopen(url, timeout=10) as oper_url:
+        return oper_url.read()
+
+
 def build_df_from_items(json_dict: dict) -> pd.DataFrame:
     """
     Assuming the input dictionary has the key "items", this will create a DataFrame from
@@ -135,13 +425,61 @@ def build_df_from_items(json_dict: dict) -> pd.DataFrame:
     - count
     - percent
     """
-    formula_or_cask = get_formula_or_cask(json_dict.get("items")[0].keys())
+    # Fail the same way build_df_from_items_stream does, if the items aren't formulae
+    # or casks
+    get_formula_or_cask(json_dict.get("items")[0].keys())
 
     df = pd.DataFrame(json_dict["items"])
-    df[formula_or_cask] = df[formula_or_cask].astype("string")
     df["count"] = df["count"].str.replace(",", "").astype("int")
     df.percent = df.percent.astype("float")
-    return df
+    return schema.apply_schema(df)
+
+
+def build_df_from_items_stream(stream: IO) -> pd.DataFrame:
+    """
+    Build the same DataFrame as build_df_from_items(), but parse the "items" array one
+    item at a time straight into typed columns, instead of first loading every item as
+    a dict.
+
+    Formula/cask names are interned, so each distinct name is stored once, counts have
+    their thousands separators removed as they are read, and percents are float32.
+    The columns are then narrowed to the dtypes in schema.py
+    """
+    names = dict()
+    name_ids = array("q")
+    numbers = array("q")
+    counts = array("q")
+    percents = array("f")
+    formula_or_cask = None
+
+    items = json_stream.iter_json_array(stream, key="items", flat=True)
+    while True:
+        batch = list(itertools.islice(items, 8192))
+        if not batch:
+            break
+        if formula_or_cask is None:
+            formula_or_cask = get_formula_or_cask(batch[0].keys())
+        name_ids.extend(
+            [names.setdefault(i[formula_or_cask], len(names)) for i in batch]
+        )
+        numbers.extend([int(i["number"]) for i in batch])
+        counts.extend([int(i["count"].replace(",", "")) for i in batch])
+        percents.extend([float(i["percent"]) for i in batch])
+
+    if formula_or_cask is None:
+        raise KeyError("Could not find any items")
+
+    df = pd.DataFrame(
+        {
+            "number": np.frombuffer(numbers, dtype=np.int64),
+            formula_or_cask: pd.Categorical.from_codes(
+                np.frombuffer(name_ids, dtype=np.int64), categories=list(names)
+            ),
+            "count": np.frombuffer(counts, dtype=np.int64),
+            "percent": np.frombuffer(percents, dtype=np.float32),
+        }
+    )
+    return schema.apply_schema(df)
 
 
 def get_unique_formulas(dfs: List[pd.DataFrame]) -> set:
@@ -169,12 +507,44 @@ def get_available_formula_json(formula_name: str) -> dict:
         return dict()
 
 
-def get_available_formula_json_parallel(formulae: Iterable[str]) -> List[dict]:
+def get_available_formula_json_parallel(
+    formulae: Iterable[str], concurrency: int = 32, per_host_rate: float = None
+) -> List[dict]:
+    """
+    Get the json data for all the formulae concurrently. Like
+    get_available_formula_json(), a formula without data gives an empty dict
+    """
+    urls = [create_formula_json_url(f) for f in formulae]
+    return async_fetch.fetch_json_many(
+        urls, concurrency=concurrency, per_host_rate=per_host_rate
+    )
+
+
+def get_formula_json_bulk(
+    formulae: Iterable[str], source: str = None, cache: http_cache.ResponseCache = None
+) -> List[dict]:
     """
-    Call get_available_formula_json() on all the formulae in parallel
+    Get the json data for many formulae from one document listing every formula,
+    instead of one request per formula. `source` is the url of homebrew's formula
+    catalog by default, but can also be the path to a local copy of it.
+
+    The catalog is parsed one formula at a time, and only the formulae asked for are
+    kept. If a cache is given, a remote catalog is downloaded through it
     """
-    with Pool() as p:
-        return p.map(get_available_formula_json, formulae)
+    if source is None:
+        source = formula_catalog_url
+    wanted = set(formulae)
+
+    if os.path.isfile(source):
+        stream = open(source, "rb")
+    elif cache is not None:
+        stream = open(cache.fetch_path(source), "rb")
+    else:
+        stream = request.urlopen(source, timeout=30)
+    with stream:
+        return [
+            f for f in json_stream.iter_json_array(stream) if f.get("name") in wanted
+        ]
 
 
 def get_formula_or_cask(dict_keys) -> str:
@@ -191,42 +561,79 @@ def create_formula_install_df(data_dict: Dict[str, pd.DataFrame]) -> pd.DataFram
     Takes a dictionary of all the data downloaded, and produces a single dataframe with
     the columns
         - formula
-        - count
-        - pct_on_request
-        - percent
+        - count_regular
+        - percent_regular
         - os
         - n_days
-    """
-    # Downselect to just the dfs of formula data
-    downselected = {
-        url: data_dict[url]
-        for url in data_dict.keys()
-        if ("cask" not in url) and ("build" not in url)
-    }
+        - count_on_request
+        - percent_on_request
+        - pct_on_request
 
-    # Split into install and install on request
-    installs = {
-        url: downselected[url] for url in downselected.keys() if "on-request" not in url
-    }
-    titles = set(downselected.keys())
-    on_request = {url: downselected[url] for url in titles.difference(installs.keys())}
-
-    # Build up a dataframe from the regular install dataframes
-    reg_df = pd.concat(
-        [add_desired_cols(url, df) for url, df in installs.items()]
-    ).drop("number", axis="columns")
-
-    # Create the same columns for the requested
-    on_request_with_cols = pd.concat(
-        [add_desired_cols(url, df) for url, df in on_request.items()]
-    ).drop("number", axis="columns")
-
-    # Join the two dfs
-    main_df = reg_df.merge(
-        on_request_with_cols,
-        on=["formula", "os", "n_days"],
-        suffixes=["_regular", "_on_request"],
+    Every install and install on request feed is stacked into one long table keyed by
+    formula, os, n_days and metric, which is then reshaped to one row per formula, os
+    and n_days. Any number of windows or operating systems can be passed in, and the
+    input dataframes are not modified
+    """
+    feeds = [
+        (info, df)
+        for info, df in (
+            (parse_analytics_url(url), df) for url, df in data_dict.items()
+        )
+        if info["event"] in install_metrics
+    ]
+    os_type = schema.os_dtype(pd.Series([info["os"] for info, _ in feeds]))
+    windows = sorted(set(info["n_days"] for info, _ in feeds))
+    metrics = list(install_metrics.values())
+
+    # Stack the feeds, tagging each row with codes for its os and metric
+    long_df = pd.concat(
+        [
+            df[["formula", "count", "percent"]].assign(
+                os_code=np.int8(os_type.categories.get_loc(info["os"])),
+                n_days=np.int16(info["n_days"]),
+                window_code=np.int8(windows.index(info["n_days"])),
+                metric_code=np.int8(metrics.index(install_metrics[info["event"]])),
+            )
+            for info, df in feeds
+        ],
+        ignore_index=True,
     )
+    long_df = schema.apply_schema(long_df)
+
+    # Give every (formula, os, n_days) its own integer id, computed from the category
+    # codes, and for each metric find the first row holding each id
+    n_ids = len(long_df.formula.cat.categories) * len(os_type.categories) * len(windows)
+    ids = (
+        long_df.formula.cat.codes.to_numpy().astype(np.int64) * len(os_type.categories)
+        + long_df.os_code.to_numpy()
+    ) * len(windows) + long_df.window_code.to_numpy()
+    metric_codes = long_df.metric_code.to_numpy()
+    first_row = np.full((n_ids, len(metrics)), -1, dtype=np.int32)
+    for i in range(len(metrics)):
+        where = np.flatnonzero(metric_codes == i).astype(np.int32)
+        # return_index gives the first of any repeated ids
+        unique_ids, first = np.unique(ids[where], return_index=True)
+        first_row[unique_ids, i] = where[first]
+
+    # Walk the rows of the first metric in the order of the feeds, and line up the rows
+    # of the other metrics with them. Like an inner join, only keep formulas that are
+    # in every kind of feed
+    rows = first_row[ids[metric_codes == 0]]
+    base = np.flatnonzero(metric_codes == 0)
+    rows = rows[(rows[:, 0] == base) & (rows >= 0).all(axis=1)].T
+
+    main_df = pd.DataFrame(
+        dict(
+            formula=long_df.formula.array.take(rows[0]),
+            os=pd.Categorical.from_codes(
+                long_df.os_code.to_numpy()[rows[0]], dtype=os_type
+            ),
+            n_days=long_df.n_days.to_numpy()[rows[0]],
+        )
+    )
+    for i, metric in enumerate(metrics):
+        for field in ["count", "percent"]:
+            main_df[f"{field}_{metric}"] = long_df[field].to_numpy()[rows[i]]
 
     # Calculate percent installed on request
     main_df["pct_on_request"] = main_df.count_on_request / main_df.count_regular * 100
@@ -235,24 +642,41 @@ def create_formula_install_df(data_dict: Dict[str, pd.DataFrame]) -> pd.DataFram
     # where pct_on_request > 100. Remove these rows
     main_df = main_df.loc[main_df.pct_on_request.le(100)]
 
-    return main_df
+    return schema.apply_schema(
+        main_df[
+            [
+                "formula",
+                "count_regular",
+                "percent_regular",
+                "os",
+                "n_days",
+                "count_on_request",
+                "percent_on_request",
+                "pct_on_request",
+            ]
+        ].reset_index(drop=True)
+    )
 
 
-def add_desired_cols(url: str, df: pd.DataFrame) -> pd.DataFrame:
+def parse_analytics_url(url: str) -> dict:
     """
-    Take in a dataframe and add the columns `os` and `n_days`
+    Read what an analytics url holds from the url itself: the os, the kind of event
+    (install, install-on-request, cask-install or build-error), and the number of days
     """
-    # Get the OS
-    os = "linux" if "linux" in url else "macos"
+    match = re.search(r"/analytics(?:-(\w+))?/([\w-]+)/(\d+)d\.json$", url)
+    return dict(
+        os=match.group(1) or "macos", event=match.group(2), n_days=int(match.group(3))
+    )
 
-    # Get the number of days this set of data is relevant for
-    n_days = int(re.findall(r"(\d+)d\.json$", url)[0])
 
-    # Add the columns
-    df["os"] = os
-    df.os = df.os.astype("string")
-    df["n_days"] = n_days
-    return df
+def add_desired_cols(url: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return a copy of the dataframe with the columns `os` and `n_days` added
+    """
+    info = parse_analytics_url(url)
+    return schema.apply_schema(
+        df.assign(os=info["os"], n_days=np.int16(info["n_days"]))
+    )
 
 
 def create_cask_install_df(data_dict: Dict[str, pd.DataFrame]) -> pd.DataFrame:
@@ -262,12 +686,13 @@ def create_cask_install_df(data_dict: Dict[str, pd.DataFrame]) -> pd.DataFrame:
     # Filter down to just the cask entries in the dict
     casks = {url: data_dict[url] for url in data_dict.keys() if "cask" in url}
 
-    # Add n_days as a column to each dataframe
-    for url, df in casks.items():
-        df["n_days"] = int(re.findall(r"(\d+)d\.json$", url)[0])
-
-    # Stack the dfs and return
-    return pd.concat(casks.values())
+    # Stack the dfs, with n_days added as a column to each, and return
+    return pd.concat(
+        [
+            df.assign(n_days=np.int16(parse_analytics_url(url)["n_days"]))
+            for url, df in casks.items()
+        ]
+    )
 
 
 def create_build_errors_df(data_dict: Dict[str, pd.DataFrame]) -> pd.DataFrame:
@@ -296,16 +721,131 @@ def create_dependencies_graph(
     )
 
 
-def json_cache(var, filename: str):
+def create_dependency_closure(dep_graph: List[Tuple[str, str]]) -> Dict[str, dict]:
     """
-    Check if filename already exists
-    If not, save it
+    For every formula in the graph, find
+        - dependencies: what it directly depends on
+        - transitive: everything it depends on, directly or not
+        - depth: the length of the longest chain of dependencies below it
+        - dependents: every formula that depends on it, directly or not
+    Formulae in a dependency cycle depend on each other, and share a depth
     """
-    if os.path.isfile(filename) is False:
-        with open(filename, "w") as f:
-            f.write(json.dumps(var))
+    direct = dict()
+    for package, dep in dep_graph:
+        direct.setdefault(package, []).append(dep)
+        direct.setdefault(dep, [])
+
+    # Walk the cycle-free graph of strongly connected components, dependencies first,
+    # so each component's closure is built from finished ones
+    names, graph = graph_order.condense_edges(dep_graph)
+    members = graph_order.component_members(graph)
+    below = []
+    depth = []
+    for component, deps in enumerate(graph_order.component_dependencies(graph)):
+        reached = set()
+        deepest = 0
+        for dep in deps:
+            reached.add(dep)
+            reached.update(below[dep])
+            deepest = max(deepest, depth[dep] + 1)
+        below.append(reached)
+        depth.append(deepest)
+
+    transitive = dict()
+    for component, nodes in enumerate(members):
+        reached = [names[m] for c in below[component] for m in members[c]]
+        for node in nodes:
+            # The rest of its own component, if it is in a cycle
+            transitive[names[node]] = reached + [names[m] for m in nodes if m != node]
+
+    dependents = {formula: set() for formula in direct}
+    for formula, reached in transitive.items():
+        for dep in reached:
+            dependents[dep].add(formula)
+
+    labels = graph.labels.tolist()
+    return {
+        formula: dict(
+            dependencies=direct[formula],
+            transitive=sorted(transitive[formula]),
+            depth=depth[labels[i]],
+            dependents=sorted(dependents[formula]),
+        )
+        for i, formula in enumerate(direct)
+    }
+
+
+def save_table(df: pd.DataFrame, filename: str):
+    """
+    Save df as a CSV, and, if columnar_output is set, as a columnar copy too
+    """
+    df.to_csv(filename, index=False)
+    if columnar_output:
+        storage.write_columnar(df, filename)
 
 
+def save_graph(graph: List[Tuple[str, str]], filename: str):
+    """
+    Save a list of edges as JSON. The app reads the graphs from the edge store (see
+    edge_store.py) instead, when it is as new
+    """
+    save_json(graph, filename)
+
+
+def save_json(var, filename: str):
+    """
+    Save var as JSON. Files made from formula_info.json are always rewritten, so they
+    are never older than the catalog they come from
+    """
+    with open(filename, "w") as f:
+        f.write(json.dumps(var))
+
+
+def json_cache(var, filename: str, max_age: float = None):
+    """
+    Check if filename already exists, and is no older than max_age seconds
+    If not, save it. Only for data fetched from the internet, such as
+    formula_info.json, and not for files made from it
+    """
+    if file_is_fresh(filename, max_age) is False:
+        save_json(var, filename)
+
+
+# The metric each kind of formula install feed is turned into by
+# create_formula_install_df
+install_metrics = {"install": "regular", "install-on-request": "on_request"}
+
+formula_catalog_url = "https://formulae.brew.sh/api/formula.json"
+
+
+def file_is_fresh(filename: str, max_age: float = None) -> bool:
+    """
+    Whether filename exists, and (if max_age is given) was written in the last max_age
+    seconds
+    """
+    if os.path.isfile(filename) is False:
+        return False
+    return max_age is None or time.time() - os.path.getmtime(filename) <= max_age
+
+
+# How long, in seconds, downloaded analytics stay fresh before being revalidated
+response_ttl = 60 * 60
+# Limits on the size and age of the http cache
+response_cache_max_bytes = 2 * 1024**3
+response_cache_max_age = 60 * 60 * 24 * 30
+# How long formula_info.json, and the graphs made from it, are used before refreshing
+formula_info_max_age = 60 * 60 * 24
+# Whether to also save every table in columnar form, for faster loading by the app
+columnar_output = True
+# Whether to also save the run report in Prometheus' text format, as run_report.prom
+prometheus_output = False
+# Whether to add each run's tables to the dated history in data/history
+history_output = True
+# How many of the formulae with the highest PageRank to draw the neighborhoods of
+ego_graphs_top_n = 10
+# How many stages of the data step may run at the same time
+pipeline_workers = 4
+
 install_and_error_urls = [
     "https://formulae.brew.sh/api/analytics/install/30d.json",
     "https://formulae.brew.sh/api/analytics/install/90d.json",
@@ -331,5 +871,31 @@ install_and_error_urls = [
 ]
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Download homebrew's analytics and formula data, and build the "
+        "tables the app draws from. Stages whose inputs haven't changed are skipped"
+    )
+    parser.add_argument(
+        "--stage",
+        action="append",
+        dest="stages",
+        help="only run this stage, and the stages it needs. Can be given more than once",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="run stages even if they are up to date"
+    )
+    parser.add_argument("--workers", type=int, default=pipeline_workers)
+    parser.add_argument(
+        "--list", action="store_true", help="list the stages and what each one needs"
+    )
+    args = parser.parse_args()
 
+    stages = pipeline_stages("")
+    if args.list:
+        for stage in stages:
+            print(f"{stage.name:<20} <- {', '.join(stage.inputs)}")
+    else:
+        unknown = set(args.stages or []).difference(s.name for s in stages)
+        if unknown:
+            parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+        main(args.stages, args.workers, args.force)
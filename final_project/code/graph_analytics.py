@@ -0,0 +1,228 @@
+"""
+Whole-graph metrics for the dependency graph: how many formulae break if one does
+(its blast radius), PageRank, how deep its dependencies go, and how many installs
+depend on it. Everything works on integer ids with numpy, with reachability kept as
+bitsets, so the whole homebrew graph takes a fraction of a second. Dependency cycles
+are collapsed first (see graph_order), and the formulae in one depend on each other
+"""
+from typing import Dict, Tuple
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+import graph_order
+import schema
+
+# How many formulae's bits are propagated through the graph at once. Bigger is faster,
+# but the bitsets take (number of formulae) * block_size / 8 bytes
+block_size = 4096
+
+
+def edge_ids(edges: pd.DataFrame) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+    """
+    The names of every formula in the package, depends_on edges, and each edge's
+    package (src) and depends_on (dst) as positions in those names
+    """
+    if not (
+        isinstance(edges.package.dtype, pd.CategoricalDtype)
+        and edges.package.dtype == edges.depends_on.dtype
+    ):
+        edges = schema.apply_schema(edges[["package", "depends_on"]])
+
+    # Renumber the shared category codes down to just the formulae in the graph
+    codes = np.concatenate(
+        [edges.package.cat.codes.to_numpy(), edges.depends_on.cat.codes.to_numpy()]
+    )
+    used, ids = np.unique(codes, return_inverse=True)
+    names = edges.package.cat.categories[used]
+    return names, ids[: len(edges)], ids[len(edges) :]
+
+
+def dependency_levels(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    For each of the n nodes, the length of the longest chain of dependencies below it,
+    found by peeling off the nodes whose dependencies are all done, a level at a time.
+    The graph should have no cycles, e.g. be a graph_order.condense() of one. Nodes in
+    or above a cycle are never done, and get -1
+    """
+    remaining = np.bincount(src, minlength=n)
+    level = np.full(n, -1)
+    frontier = np.flatnonzero(remaining == 0)
+    depth = 0
+    while len(frontier) > 0:
+        level[frontier] = depth
+        # One fewer dependency left for everything depending on the frontier
+        done = np.zeros(n, dtype=bool)
+        done[frontier] = True
+        remaining -= np.bincount(src[done[dst]], minlength=n)
+        frontier = np.flatnonzero((remaining == 0) & (level == -1))
+        depth += 1
+
+    if (level == -1).any():
+        warn(f"{(level == -1).sum()} formulae are in or depend on a dependency cycle")
+    return level
+
+
+def reachability_counts(
+    n: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    level: np.ndarray,
+    weights: np.ndarray,
+    sizes: np.ndarray = None,
+) -> Dict[str, np.ndarray]:
+    """
+    For each node, count its transitive dependencies and transitive dependents, and add
+    up the weights of its transitive dependents. If the nodes stand for several
+    formulae each, as the components of a condensation do, each counts as sizes of them.
+
+    Each node gets a bitset of everything below it, built level by level from its
+    direct dependencies' bitsets. Dependents are then counted down the bitsets' columns.
+    block_size columns are done at a time to bound the memory used
+    """
+    sizes = np.ones(n) if sizes is None else sizes.astype(np.float64)
+    # Edges grouped by the level of their package, then by package, for reduceat
+    ok = (level[src] >= 0) & (level[dst] >= 0)
+    order = np.lexsort((src[ok], level[src[ok]]))
+    src, dst = src[ok][order], dst[ok][order]
+    src_level = level[src]
+
+    dependencies = np.zeros(n, dtype=np.float64)
+    dependents = np.zeros(n, dtype=np.float64)
+    weighted = np.zeros(n, dtype=np.float64)
+    for start in range(0, n, block_size):
+        width = min(block_size, n - start)
+        words = (width + 63) // 64
+        below = np.zeros((n, words), dtype=np.uint64)
+
+        # The bit of each edge's depends_on, if it falls in this block
+        offset = dst - start
+        in_block = (offset >= 0) & (offset < width)
+        bit_word = np.where(in_block, offset // 64, 0)
+        bit = np.where(in_block, np.uint64(1) << (offset % 64).astype(np.uint64), 0)
+        bit = bit.astype(np.uint64)
+
+        # Level 0 formulae have no dependencies, so start from level 1
+        bounds = np.searchsorted(src_level, np.arange(1, level.max() + 2))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if lo == hi:
+                continue
+            values = below[dst[lo:hi]]
+            values[np.arange(hi - lo), bit_word[lo:hi]] |= bit[lo:hi]
+            packages, firsts = np.unique(src[lo:hi], return_index=True)
+            below[packages] = np.bitwise_or.reduceat(values, firsts, axis=0)
+
+        # Count the set bits row-wise (dependencies) and column-wise (dependents). Most
+        # words are empty, so only the others are split into their 64 bits
+        rows, cols = np.nonzero(below)
+        bits = (below[rows, cols][:, None] >> np.arange(64, dtype=np.uint64)) & 1
+        word, j = np.nonzero(bits)
+        rows, columns = rows[word], start + cols[word] * 64 + j
+        dependencies += np.bincount(rows, weights=sizes[columns], minlength=n)
+        dependents += np.bincount(columns, weights=sizes[rows], minlength=n)
+        weighted += np.bincount(columns, weights=weights[rows], minlength=n)
+
+    return dict(
+        transitive_dependencies=dependencies.astype(np.int64),
+        transitive_dependents=dependents.astype(np.int64),
+        dependents_weight=weighted,
+    )
+
+
+def pagerank(
+    n: int,
+    src: np.ndarray,
+    dst: np.ndarray,
+    damping: float = 0.85,
+    tol: float = 1e-10,
+    max_iter: int = 200,
+) -> np.ndarray:
+    """
+    PageRank over package -> depends_on edges, so rank flows to what is depended upon.
+    A formula with no dependencies spreads its rank over every formula. Each step is a
+    sparse matrix-vector product done with np.bincount
+    """
+    if n == 0:
+        return np.zeros(0)
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+    rank = np.full(n, 1 / n)
+    for _ in range(max_iter):
+        share = np.where(dangling, 0, rank / np.maximum(out_degree, 1))
+        new = (1 - damping) / n + damping * (
+            np.bincount(dst, weights=share[src], minlength=n) + rank[dangling].sum() / n
+        )
+        converged = np.abs(new - rank).sum() < tol
+        rank = new
+        if converged:
+            break
+    return rank
+
+
+def formula_install_counts(
+    formula_installs: pd.DataFrame, n_days: int = 365
+) -> pd.Series:
+    """
+    Installs of each formula over the last n_days, on every OS together
+    """
+    df = formula_installs.loc[formula_installs.n_days.eq(n_days)]
+    return df.groupby(df.formula.astype(str)).count_regular.sum()
+
+
+def graph_metrics(
+    edges: pd.DataFrame, formula_installs: pd.DataFrame = None
+) -> pd.DataFrame:
+    """
+    One row per formula in the package, depends_on edges, with columns
+        - dependencies, dependents: direct ones
+        - transitive_dependencies, transitive_dependents: direct or not. The number of
+          dependents is the formula's blast radius, everything that breaks if it does
+        - depth: the length of the longest chain of dependencies below it
+        - pagerank: how central it is to the graph, counting the importance of what
+          depends on it
+        - installs: installs in the last year, if formula_installs is given
+        - impact_installs: installs of the formula and of everything depending on it
+    """
+    names, src, dst = edge_ids(edges)
+    n = len(names)
+    # Each edge once, and no formula depending on itself
+    pairs = np.unique(src.astype(np.int64) * n + dst)
+    src, dst = pairs // n, pairs % n
+    src, dst = src[src != dst], dst[src != dst]
+
+    installs = np.zeros(n)
+    if formula_installs is not None:
+        counts = formula_install_counts(formula_installs)
+        installs = counts.reindex(names.astype(str)).fillna(0).to_numpy(np.float64)
+
+    # Work on the graph of dependency cycles collapsed to single nodes, where each
+    # formula in a cycle reaches the others, and everything the cycle reaches
+    graph = graph_order.condense(n, src, dst)
+    labels = graph.labels
+    sizes = np.bincount(labels, minlength=graph.n_components)
+    cycle_installs = np.bincount(labels, weights=installs, minlength=graph.n_components)
+    level = dependency_levels(graph.n_components, graph.src, graph.dst)
+    reach = reachability_counts(
+        graph.n_components, graph.src, graph.dst, level, cycle_installs, sizes
+    )
+    others = sizes[labels] - 1
+
+    metrics = pd.DataFrame(
+        dict(
+            formula=names,
+            dependencies=np.bincount(src, minlength=n),
+            dependents=np.bincount(dst, minlength=n),
+            transitive_dependencies=reach["transitive_dependencies"][labels] + others,
+            transitive_dependents=reach["transitive_dependents"][labels] + others,
+            depth=level[labels],
+            pagerank=pagerank(n, src, dst),
+            installs=installs.astype(np.int64),
+            impact_installs=(
+                cycle_installs[labels] + reach["dependents_weight"][labels]
+            ).astype(np.int64),
+        )
+    )
+    return schema.apply_schema(
+        metrics.sort_values("transitive_dependents", ascending=False, kind="stable")
+    )
@@ -0,0 +1,219 @@
+"""
+Draw parts of the dependency graph with Graphviz: the neighborhood of a formula, out to
+a number of hops along its dependencies and dependents, rather than the whole graph at
+once. Layouts are the slow part, so each one is cached on disk under a hash of the
+graph it was made for, and drawing the same neighborhood again only renders it. Files
+are written without opening a viewer, and many formulae are drawn at once on a pool of
+threads, each waiting on its own Graphviz process. From the `final_project` folder, e.g.
+    python code/graph_export.py openssl@1.1 python@3.9 --hops 2
+    python code/graph_export.py --top 20 --format png
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import graphviz
+import pandas as pd
+
+import create_figs
+import edge_store
+import storage
+
+this_dir = os.path.dirname(__file__)
+plots_dir = os.path.join(this_dir, "..", "plots")
+# Where drawings go, and where the layouts are kept between runs
+export_dir = os.path.join(plots_dir, "ego_graphs")
+layout_cache_dir = os.path.join(plots_dir, "layout_cache")
+
+# The most formulae drawn around one formula. The nearest are kept
+max_nodes = 150
+
+
+def neighbors(edges: pd.DataFrame) -> Dict[str, Dict[str, List[str]]]:
+    """
+    What each formula depends on, and what depends on it, from a table of package,
+    depends_on edges
+    """
+    reverse = edges.rename(columns=dict(package="depends_on", depends_on="package"))
+    return dict(
+        dependencies=create_figs.edge_adjacency(edges),
+        dependents=create_figs.edge_adjacency(reverse),
+    )
+
+
+def ego_graph(
+    neighbors: Dict[str, Dict[str, List[str]]],
+    formula: str,
+    hops: int = 1,
+    direction: str = "both",
+    max_nodes: int = max_nodes,
+) -> List[Tuple[str, str]]:
+    """
+    The package, depends_on edges between the formulae within `hops` steps of
+    `formula`, following its dependencies, its dependents, or both. Walked breadth
+    first, so only the neighborhood is visited, and only the max_nodes nearest are kept
+    """
+    directions = ["dependencies", "dependents"] if direction == "both" else [direction]
+    reached = {formula: 0}
+    frontier = [formula]
+    for hop in range(1, hops + 1):
+        next_frontier = []
+        for node in frontier:
+            for way in directions:
+                for other in neighbors[way].get(node, []):
+                    if other not in reached and len(reached) < max_nodes:
+                        reached[other] = hop
+                        next_frontier.append(other)
+        frontier = next_frontier
+
+    return [
+        (package, dep)
+        for package in reached
+        for dep in neighbors["dependencies"].get(package, [])
+        if dep in reached
+    ]
+
+
+def ego_source(formula: str, edges: List[Tuple[str, str]]) -> str:
+    """
+    The DOT source of an ego graph, with `formula` highlighted
+    """
+    dot = graphviz.Digraph(name=formula, graph_attr=dict(rankdir="LR"))
+    dot.node(formula, style="filled", fillcolor="lightblue")
+    for package, dep in edges:
+        dot.edge(package, dep)
+    return dot.source
+
+
+def layout(source: str, engine: str = "dot", cache_dir: str = layout_cache_dir) -> str:
+    """
+    The DOT source with every node and edge positioned by `engine`. Layouts are kept in
+    cache_dir under a hash of the source and engine, so a graph that hasn't changed is
+    never laid out twice
+    """
+    key = hashlib.sha256(f"{engine}\n{source}".encode()).hexdigest()
+    cached = os.path.join(cache_dir, f"{key}.gv")
+    if os.path.isfile(cached):
+        with open(cached) as f:
+            return f.read()
+
+    positioned = graphviz.Source(source, engine=engine).pipe(
+        format="dot", encoding="utf-8"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    with storage.atomic_write(cached) as f:
+        f.write(positioned)
+    return positioned
+
+
+def render(
+    source: str,
+    filename: str,
+    format: str = "svg",
+    engine: str = "dot",
+    cache_dir: str = layout_cache_dir,
+) -> str:
+    """
+    Draw the graph to filename.<format>, from its cached layout if there is one. Returns
+    the path written
+    """
+    positioned = layout(source, engine, cache_dir)
+    # neato -n2 draws nodes and edges where the layout put them, without laying out
+    drawing = graphviz.Source(positioned, engine="neato").pipe(
+        format=format, neato_no_op=2
+    )
+    path = f"{filename}.{format}"
+    # Only made once there is a drawing to put in it, so that a run without Graphviz
+    # doesn't leave an empty folder that looks like its output
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(drawing)
+    return path
+
+
+def render_many(
+    jobs: List[tuple], threads: int = None, view: bool = False
+) -> List[str]:
+    """
+    Run render(*job) for every job, on `threads` threads, and return the paths written.
+    The work is done by the Graphviz processes they start, so threads are enough, and
+    unlike forking they are safe inside the data step's own thread pool. Only opens the
+    drawings in a viewer if view is set
+    """
+    if len(jobs) == 1 or threads == 1:
+        paths = [render(*job) for job in jobs]
+    else:
+        with ThreadPoolExecutor(threads or os.cpu_count()) as pool:
+            paths = list(pool.map(lambda job: render(*job), jobs))
+    if view:
+        for path in paths:
+            graphviz.view(path)
+    return paths
+
+
+def top_formulae(metrics: pd.DataFrame, n: int, metric: str = "pagerank") -> List[str]:
+    """
+    The n formulae highest in graph_metrics.csv's `metric`
+    """
+    return metrics.nlargest(n, metric).formula.astype(str).tolist()
+
+
+def export(
+    edges: pd.DataFrame,
+    formulae: List[str],
+    hops: int = 1,
+    direction: str = "both",
+    format: str = "svg",
+    output_dir: str = export_dir,
+    threads: int = None,
+    view: bool = False,
+) -> List[str]:
+    """
+    Draw the ego graph of each formula into output_dir, in parallel, and return the
+    paths written
+    """
+    around = neighbors(edges)
+    jobs = []
+    for formula in formulae:
+        source = ego_source(formula, ego_graph(around, formula, hops, direction))
+        # Tap formulae have slashes in their names
+        name = f"{formula.replace('/', '_')}_{hops}hop"
+        jobs.append((source, os.path.join(output_dir, name), format))
+    return render_many(jobs, threads, view)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("formulae", nargs="*", help="formulae to draw")
+    parser.add_argument(
+        "--top", type=int, default=0, help="also draw the top N formulae by PageRank"
+    )
+    parser.add_argument("--hops", type=int, default=1)
+    parser.add_argument(
+        "--direction", choices=["both", "dependencies", "dependents"], default="both"
+    )
+    parser.add_argument("--format", default="svg")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--view", action="store_true", help="open each drawing")
+    parser.add_argument("--data", default=os.path.join(this_dir, "..", "data"))
+    parser.add_argument("--output", default=export_dir)
+    args = parser.parse_args()
+
+    formulae = list(args.formulae)
+    if args.top:
+        metrics = storage.read_frame(os.path.join(args.data, "graph_metrics.csv"))
+        formulae += [f for f in top_formulae(metrics, args.top) if f not in formulae]
+
+    paths = export(
+        edge_store.read_graph(os.path.join(args.data, "dep_graph.json")),
+        formulae,
+        args.hops,
+        args.direction,
+        args.format,
+        args.output,
+        args.threads,
+        args.view,
+    )
+    print("\n".join(paths))
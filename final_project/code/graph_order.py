@@ -0,0 +1,138 @@
+"""
+Strongly connected components of dependency graphs, found with an iterative version of
+Tarjan's algorithm so that neither cycles nor very long chains of dependencies can hit
+the recursion limit. Collapsing each component to one node leaves a graph with no
+cycles, whose components come out in an order where dependencies are always first, so
+closures, depths and levels can be built in a single pass over it
+"""
+from typing import Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+
+class Condensation(NamedTuple):
+    """
+    A graph with each strongly connected component collapsed to one node. Components
+    are numbered in topological order, dependencies first, so every edge between two
+    components goes from a higher number to a lower one
+    """
+
+    # The component of each node
+    labels: np.ndarray
+    n_components: int
+    # The edges between components, each once, as package -> depends_on
+    src: np.ndarray
+    dst: np.ndarray
+
+
+def component_labels(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    Tarjan's algorithm over the n nodes and src -> dst edges, in O(nodes + edges). A
+    component is only numbered once everything it points to has been, which numbers
+    them dependencies first
+    """
+    # Each node's edges as a slice of targets, like a CSR matrix. Plain lists, as
+    # indexing numpy arrays one item at a time is slow
+    order = np.argsort(src, kind="stable")
+    targets = dst[order].tolist()
+    starts = np.searchsorted(src[order], np.arange(n + 1)).tolist()
+
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    labels = [-1] * n
+    stack = []
+    counter = 0
+    n_components = 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        # The depth first path, as (node, position of the next edge to follow)
+        path = [(root, starts[root])]
+        while path:
+            node, edge = path[-1]
+            if edge < starts[node + 1]:
+                path[-1] = (node, edge + 1)
+                dep = targets[edge]
+                if index[dep] < 0:
+                    index[dep] = low[dep] = counter
+                    counter += 1
+                    stack.append(dep)
+                    on_stack[dep] = True
+                    path.append((dep, starts[dep]))
+                elif on_stack[dep]:
+                    low[node] = min(low[node], index[dep])
+                continue
+
+            # Every edge of node is done
+            path.pop()
+            if path:
+                parent = path[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                # node is the first of its component reached, and the rest are above
+                # it on the stack
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    labels[member] = n_components
+                    if member == node:
+                        break
+                n_components += 1
+
+    return np.array(labels, dtype=np.int64)
+
+
+def condense(n: int, src: np.ndarray, dst: np.ndarray) -> Condensation:
+    """
+    The condensation of the graph of n nodes and src -> dst edges
+    """
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    labels = component_labels(n, src, dst)
+    n_components = int(labels.max()) + 1 if n > 0 else 0
+
+    # Edges between different components, each once
+    pairs = np.unique(labels[src] * max(n_components, 1) + labels[dst])
+    component_src, component_dst = np.divmod(pairs, max(n_components, 1))
+    between = component_src != component_dst
+    return Condensation(
+        labels, n_components, component_src[between], component_dst[between]
+    )
+
+
+def condense_edges(edges: Iterable[Tuple[str, str]]) -> Tuple[List[str], Condensation]:
+    """
+    condense() for a list of (package, depends_on) names. Nodes are numbered in the
+    order they first appear, and their names are returned along with the condensation
+    """
+    ids = dict()
+    src, dst = [], []
+    for package, dep in edges:
+        src.append(ids.setdefault(package, len(ids)))
+        dst.append(ids.setdefault(dep, len(ids)))
+    return list(ids), condense(len(ids), np.array(src), np.array(dst))
+
+
+def component_members(graph: Condensation) -> List[List[int]]:
+    """
+    The nodes in each component
+    """
+    members = [[] for _ in range(graph.n_components)]
+    for node, component in enumerate(graph.labels.tolist()):
+        members[component].append(node)
+    return members
+
+
+def component_dependencies(graph: Condensation) -> List[List[int]]:
+    """
+    The components each component directly depends on
+    """
+    dependencies = [[] for _ in range(graph.n_components)]
+    for package, dep in zip(graph.src.tolist(), graph.dst.tolist()):
+        dependencies[package].append(dep)
+    return dependencies
@@ -0,0 +1,190 @@
+"""
+A history of the analytics tables. homebrew only publishes rolling 30, 90 and 365 day
+totals, so each run of the data step appends a dated snapshot of its tables here, and
+over time they add up to real trends. Each table has a folder of snapshots, one
+compressed .npz file per day, with its rows sorted by formula (or cask) and the
+position of each one's first row alongside. A query only opens the snapshots in its
+date range, found from their file names, finds a formula's rows in each by binary
+search, and only decompresses the columns it needs
+"""
+
+import bisect
+import os
+from datetime import date
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+import schema
+import storage
+
+
+def table_dir(history_dir: str, table: str) -> str:
+    return os.path.join(history_dir, table)
+
+
+def key_column(df: pd.DataFrame) -> str:
+    """
+    The name column a table's snapshots are sorted and searched by
+    """
+    return next(c for c in schema.NAME_COLUMNS if c in df.columns)
+
+
+def append_snapshot(
+    df: pd.DataFrame, history_dir: str, table: str, day: date = None
+) -> str:
+    """
+    Save df as the snapshot of `table` for `day` (today by default), and return its
+    path. Snapshots are never changed once written, except that running again on the
+    same day replaces that day's, if df is different
+    """
+    day = date.today() if day is None else day
+    key = key_column(df)
+    # Sorted by the names themselves rather than their category codes, which are only
+    # in name order for tables made here, not for those read back from a columnar copy
+    df = df.sort_values(
+        [key] + [c for c in ["os", "n_days"] if c in df.columns],
+        kind="stable",
+        key=lambda column: column.astype(str) if column.name == key else column,
+    )
+
+    arrays = dict()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values) and not isinstance(
+            values.dtype, pd.CategoricalDtype
+        ):
+            arrays[column] = values.to_numpy()
+        else:
+            # Text as int32 codes into its sorted distinct values, kept as one UTF-8
+            # string, so codes of the sorted key column are sorted too
+            strings = values.astype(str)
+            categories = np.sort(strings.unique())
+            codes = np.searchsorted(categories, strings).astype(np.int32)
+            arrays[column] = codes
+            arrays[f"{column}.categories"] = np.frombuffer(
+                "\n".join(categories).encode(), dtype=np.uint8
+            )
+            if column == key:
+                # Where each name's rows start, and where the last one's end
+                arrays[f"{column}.starts"] = np.searchsorted(
+                    codes, np.arange(len(categories) + 1)
+                )
+
+    directory = table_dir(history_dir, table)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{day.isoformat()}.npz")
+    if os.path.isfile(path):
+        with np.load(path) as snapshot:
+            unchanged = set(snapshot.files) == set(arrays) and all(
+                np.array_equal(snapshot[name], values)
+                for name, values in arrays.items()
+            )
+        if unchanged:
+            return path
+
+    with storage.atomic_write(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    return path
+
+
+def snapshot_dates(history_dir: str, table: str) -> List[date]:
+    """
+    The days `table` has a snapshot for, oldest first
+    """
+    directory = table_dir(history_dir, table)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        date.fromisoformat(f[: -len(".npz")])
+        for f in os.listdir(directory)
+        if f.endswith(".npz")
+    )
+
+
+def read_snapshot(
+    history_dir: str,
+    table: str,
+    day: date,
+    names: List[str] = None,
+    columns: List[str] = None,
+) -> pd.DataFrame:
+    """
+    The snapshot of `table` for `day`, or just the rows of the formulae (or casks) in
+    names. Only the columns asked for are decompressed
+    """
+    path = os.path.join(table_dir(history_dir, table), f"{day.isoformat()}.npz")
+    with np.load(path) as snapshot:
+        stored = [f for f in snapshot.files if "." not in f]
+        key = next(c for c in schema.NAME_COLUMNS if c in stored)
+        columns = (
+            stored
+            if columns is None
+            else [key] + [c for c in columns if c in stored and c != key]
+        )
+
+        rows = slice(None)
+        found = None
+        if names is not None:
+            categories = read_categories(snapshot, key)
+            starts = snapshot[f"{key}.starts"]
+            found = dict()
+            for name in names:
+                code = bisect.bisect_left(categories, name)
+                if code < len(categories) and categories[code] == name:
+                    found[name] = (starts[code], starts[code + 1])
+            rows = np.concatenate(
+                [np.arange(lo, hi) for lo, hi in found.values()]
+                + [np.zeros(0, dtype=np.int64)]
+            )
+
+        data = dict()
+        for column in columns:
+            if column == key and found is not None:
+                # Known from the lookup, without reading the column
+                data[column] = np.repeat(
+                    np.array(list(found), dtype=object),
+                    [hi - lo for lo, hi in found.values()],
+                )
+                continue
+            values = snapshot[column][rows]
+            if f"{column}.categories" in snapshot.files:
+                values = np.array(read_categories(snapshot, column), dtype=object)[
+                    values
+                ]
+            data[column] = values
+    return schema.apply_schema(pd.DataFrame(data))
+
+
+def read_categories(snapshot: np.lib.npyio.NpzFile, column: str) -> List[str]:
+    blob = snapshot[f"{column}.categories"].tobytes().decode()
+    return blob.split("\n") if blob else []
+
+
+def trend(
+    history_dir: str,
+    table: str,
+    names: List[str] = None,
+    start: date = None,
+    end: date = None,
+    columns: List[str] = None,
+) -> pd.DataFrame:
+    """
+    The rows of the formulae (or casks) in names, or of everything, from every
+    snapshot of `table` between start and end (inclusive), with a date column added
+    """
+    days = [
+        d
+        for d in snapshot_dates(history_dir, table)
+        if (start is None or d >= start) and (end is None or d <= end)
+    ]
+    frames = [
+        read_snapshot(history_dir, table, d, names, columns).assign(
+            date=pd.Timestamp(d)
+        )
+        for d in days
+    ]
+    if not frames:
+        return pd.DataFrame(columns=(columns or []) + ["date"])
+    return schema.apply_schema(pd.concat(frames, ignore_index=True))
@@ -0,0 +1,168 @@
+"""
+An on-disk cache of HTTP responses that revalidates stale entries with conditional
+requests, so that refreshing data that hasn't changed downloads almost nothing
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict
+from urllib import request
+from urllib.error import HTTPError
+
+import storage
+
+
+class ResponseCache:
+    """
+    Response bodies are stored under their sha256 digest in `directory`, next to an
+    index.json mapping each url to its digest, ETag/Last-Modified headers, when it was
+    last confirmed up to date, and how long it stays fresh (its ttl, in seconds).
+
+    A fresh entry is returned without touching the network. A stale one is checked with
+    a conditional request, and only downloaded again if the server says it changed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        default_ttl: float = 60 * 60,
+        max_bytes: int = None,
+        max_age: float = None,
+        timeout: float = 10,
+    ):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        self.stats = dict(hits=0, revalidated=0, misses=0, bytes_downloaded=0)
+        # Several threads can fetch through one cache, so guard the index and stats
+        self.lock = threading.RLock()
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.index_file = os.path.join(directory, "index.json")
+        self.index: Dict[str, dict] = dict()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                self.index = json.loads(f.read())
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest)
+
+    def fetch_path(self, url: str, ttl: float = None) -> str:
+        """
+        Make sure an up to date copy of `url` is in the cache, and return the path of
+        the file holding its body
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        with self.lock:
+            entry = self.index.get(url)
+            now = time.time()
+
+            if entry is not None and not os.path.isfile(
+                self.object_path(entry["digest"])
+            ):
+                entry = None
+
+            if entry is not None and now - entry["checked"] < ttl:
+                self.stats["hits"] += 1
+                entry["ttl"] = ttl
+                return self.object_path(entry["digest"])
+
+            headers = dict()
+            if entry is not None:
+                if entry.get("etag"):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry.get("last_modified"):
+                    headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = request.urlopen(
+                request.Request(url, headers=headers), timeout=self.timeout
+            )
+        except HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+            with self.lock:
+                self.stats["revalidated"] += 1
+                entry.update(checked=now, ttl=ttl)
+                self.save_index()
+                return self.object_path(entry["digest"])
+
+        with response:
+            body = response.read()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        with self.lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_downloaded"] += len(body)
+
+            digest = hashlib.sha256(body).hexdigest()
+            path = self.object_path(digest)
+            if not os.path.isfile(path):
+                with storage.atomic_write(path, "wb") as f:
+                    f.write(body)
+
+            self.index[url] = dict(
+                digest=digest,
+                size=len(body),
+                etag=etag,
+                last_modified=last_modified,
+                checked=now,
+                ttl=ttl,
+            )
+            self.evict(keep=url)
+            self.save_index()
+            return path
+
+    def fetch(self, url: str, ttl: float = None) -> bytes:
+        """
+        Get the body of `url`, from the cache if it is still up to date
+        """
+        with open(self.fetch_path(url, ttl), "rb") as f:
+            return f.read()
+
+    def evict(self, keep: str = None):
+        """
+        Forget entries older than max_age, then the least recently checked ones until
+        the cache is no bigger than max_bytes, and delete bodies nothing points to.
+        The entry for `keep` is never forgotten
+        """
+        now = time.time()
+        if self.max_age is not None:
+            self.index = {
+                url: entry
+                for url, entry in self.index.items()
+                if now - entry["checked"] <= self.max_age
+            }
+
+        if self.max_bytes is not None:
+            by_age = sorted(self.index.items(), key=lambda kv: kv[1]["checked"])
+            total = sum(entry["size"] for entry in self.index.values())
+            for url, entry in by_age:
+                if total <= self.max_bytes:
+                    break
+                if url == keep:
+                    continue
+                del self.index[url]
+                total -= entry["size"]
+
+        in_use = set(entry["digest"] for entry in self.index.values())
+        for name in os.listdir(os.path.join(self.directory, "objects")):
+            if name not in in_use:
+                os.remove(self.object_path(name))
+
+    def save_index(self):
+        with storage.atomic_write(self.index_file) as f:
+            f.write(json.dumps(self.index))
+
+    def hit_rate(self) -> float:
+        """
+        Fraction of lookups that did not need to download a body
+        """
+        lookups = self.stats["hits"] + self.stats["revalidated"] + self.stats["misses"]
+        if lookups == 0:
+            return 0.0
+        return (self.stats["hits"] + self.stats["revalidated"]) / lookups
@@ -0,0 +1,174 @@
+"""
+Record how long each stage of the data pipeline takes and what it costs, so that when a
+refresh gets slower the stage responsible can be found. A run's stages can be saved as
+a JSON report, and in Prometheus' text format for a metrics collector to pick up
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory just isn't reported
+    resource = None
+
+import http_cache
+import storage
+
+
+def peak_rss() -> int:
+    """
+    The most memory, in bytes, this process has used so far, or 0 if unknown
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunReport:
+    """
+    Collects one dict of measurements per stage of a run. For every stage it records
+        - seconds and cpu_seconds: wall and CPU time (CPU time counts every thread,
+          so it includes stages running at the same time)
+        - peak_rss_bytes: the process' peak memory by the end of the stage. It is a
+          high water mark, so the stage that raised it is the one where it jumps
+        - rows_in and rows_out: set by the code running the stage, if it has rows
+        - http_requests, bytes_downloaded and cache_hit_rate: from the response cache,
+          if one is given. Requests are the ones that reached the server, so fresh
+          cache hits are not counted. Requests made without the cache can be added to
+          the stage's dict by the code running it. Stages running at the same time
+          share the cache's counts, so they may be split between them unevenly
+        - skipped: whether the stage was skipped, as nothing it uses had changed
+    """
+
+    def __init__(self, cache: http_cache.ResponseCache = None):
+        self.cache = cache
+        self.started = time.time()
+        self.start_clock = time.perf_counter()
+        self.stages = []
+
+    def cache_stats(self) -> dict:
+        if self.cache is None:
+            return dict(hits=0, revalidated=0, misses=0, bytes_downloaded=0)
+        with self.cache.lock:
+            return dict(self.cache.stats)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = None) -> Iterator[dict]:
+        """
+        Measure the code run inside the with block as the stage `name`. The dict it
+        gives can be used to set rows_out (or rows_in) once they are known
+        """
+        record = dict(
+            name=name,
+            rows_in=rows_in,
+            rows_out=None,
+            failed=False,
+            skipped=False,
+            http_requests=0,
+            bytes_downloaded=0,
+        )
+        stats_before = self.cache_stats()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record["failed"] = True
+            raise
+        finally:
+            stats = self.cache_stats()
+            lookups = {
+                k: stats[k] - stats_before[k] for k in ("hits", "revalidated", "misses")
+            }
+            n_lookups = sum(lookups.values())
+            record["http_requests"] += lookups["revalidated"] + lookups["misses"]
+            record["bytes_downloaded"] += (
+                stats["bytes_downloaded"] - stats_before["bytes_downloaded"]
+            )
+            record.update(
+                seconds=time.perf_counter() - wall_start,
+                cpu_seconds=time.process_time() - cpu_start,
+                peak_rss_bytes=peak_rss(),
+                cache_hit_rate=(
+                    (lookups["hits"] + lookups["revalidated"]) / n_lookups
+                    if n_lookups
+                    else None
+                ),
+            )
+            self.stages.append(record)
+
+    def to_dict(self) -> dict:
+        return dict(
+            started=datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            seconds=time.perf_counter() - self.start_clock,
+            peak_rss_bytes=peak_rss(),
+            stages=self.stages,
+        )
+
+    def write_json(self, filename: str):
+        with open(filename, "w") as f:
+            f.write(json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus(self, prefix: str = "homebrew_ingest") -> str:
+        """
+        The report in Prometheus' text exposition format, with one gauge per measurement
+        labelled by stage, e.g.
+            homebrew_ingest_stage_seconds{stage="dep_graph"} 0.012
+        """
+        descriptions = dict(
+            seconds="Wall time of the stage",
+            cpu_seconds="CPU time of the stage, across all threads",
+            peak_rss_bytes="Peak memory of the process by the end of the stage",
+            rows_in="Rows the stage read",
+            rows_out="Rows the stage produced",
+            http_requests="HTTP requests the stage sent",
+            bytes_downloaded="Bytes of responses the stage downloaded",
+            cache_hit_rate="Fraction of the stage's lookups answered by the cache",
+            failed="1 if the stage raised an error",
+            skipped="1 if the stage was skipped, as nothing it uses had changed",
+        )
+        report = self.to_dict()
+        lines = []
+        for metric, description in descriptions.items():
+            name = f"{prefix}_stage_{metric}"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+            for stage in report["stages"]:
+                if stage[metric] is not None:
+                    value = float(stage[metric])
+                    lines.append(f'{name}{{stage="{stage["name"]}"}} {value}')
+
+        for metric, description, value in [
+            ("run_seconds", "Wall time of the whole run", report["seconds"]),
+            ("run_peak_rss_bytes", "Peak memory of the run", report["peak_rss_bytes"]),
+            ("run_timestamp_seconds", "When the run started", self.started),
+        ]:
+            name = f"{prefix}_{metric}"
+            lines += [
+                f"# HELP {name} {description}",
+                f"# TYPE {name} gauge",
+                f"{name} {float(value)}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename: str):
+        with storage.atomic_write(filename) as f:
+            f.write(self.to_prometheus())
+
+    def summary(self) -> str:
+        """
+        One line per stage, for printing at the end of a run
+        """
+        return "\n".join(
+            f"{s['name']:<22} {s['seconds']:8.2f}s {s['cpu_seconds']:8.2f}s cpu "
+            f"{s['peak_rss_bytes'] / 1e6:8.0f}MB rss {s['http_requests']:5} requests "
+            f"{s['bytes_downloaded'] / 1e6:8.1f}MB downloaded"
+            + (" (skipped)" if s["skipped"] else "")
+            for s in self.stages
+        )
@@ -0,0 +1,146 @@
+"""
+Parse the elements of a large JSON array one at a time, without holding the whole
+document (or a list of every element) in memory
+"""
+import codecs
+import json
+import re
+from typing import IO, Any, Iterator
+
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# The characters a number can go on with after the part of it already read
+number_parts = set("0123456789.eE+-")
+
+
+class JsonStreamReader:
+    """
+    A buffer over a file-like object (binary utf-8 or text) that decodes one JSON value
+    at a time, reading more of the file only when a value runs past the buffer
+    """
+
+    def __init__(self, stream: IO, chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.refills = 0
+
+    def read_more(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            chunk = b""
+        if isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk, final=self.eof)
+        # Drop everything already parsed, so the buffer stays around one value long
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        self.refills += 1
+        return True
+
+    def next_token(self) -> str:
+        """
+        Skip whitespace, and return the next character without consuming it
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, token: str):
+        if self.next_token() != token:
+            raise ValueError(f"Expected {token!r} at {self.buf[self.pos:][:20]!r}")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.next_token()
+        # A value cut off at the end of the buffer either fails to parse, or (for a
+        # bare number) parses too early, so read more and try again in both cases
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number cut off after its ".", "e" or sign parses as the part before
+            # it, so it is only complete once something else follows it
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            cut = end == len(self.buf) or number and self.buf[end] in number_parts
+            if cut and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def find_key(self, key: str):
+        """
+        Inside an object, skip over members until reaching the value of `key`
+        """
+        self.expect("{")
+        while True:
+            token = self.next_token()
+            if token == "}":
+                raise KeyError(key)
+            if token == ",":
+                self.pos += 1
+            name = self.decode_value()
+            self.expect(":")
+            if name == key:
+                return
+            self.decode_value()
+
+    def iter_array(self, flat: bool = False) -> Iterator[Any]:
+        """
+        Yield the elements of the array starting at the current position. If `flat`,
+        the elements are objects with no objects nested inside them, so every "}" ends
+        an element, and all the complete elements in the buffer are decoded in one call
+        """
+        self.expect("[")
+        failed_batch = None
+        while True:
+            token = self.next_token()
+            if token == "]":
+                self.pos += 1
+                return
+            if token == ",":
+                self.pos += 1
+                self.next_token()
+
+            if flat and failed_batch != self.refills:
+                end = self.buf.rfind("}", self.pos) + 1
+                if end > self.pos:
+                    try:
+                        batch = json.loads("[" + self.buf[self.pos : end] + "]")
+                    except json.JSONDecodeError:
+                        # Most likely the "}" closing the whole document, or one inside
+                        # a string. Go one at a time until the buffer is refilled
+                        failed_batch = self.refills
+                    else:
+                        self.pos = end
+                        yield from batch
+                        continue
+
+            yield self.decode_value()
+
+
+def iter_json_array(
+    stream: IO, key: str = None, flat: bool = False, chunk_size: int = 1 << 16
+) -> Iterator[Any]:
+    """
+    Yield each element of the JSON array at the top level of `stream`, or, if `key` is
+    given, of the array stored under `key` in the object at the top level. Pass
+    flat=True when the elements are objects that don't contain other objects, to
+    decode them a buffer at a time rather than one by one
+    """
+    reader = JsonStreamReader(stream, chunk_size)
+    if key is not None:
+        reader.find_key(key)
+    return reader.iter_array(flat)
@@ -0,0 +1,175 @@
+"""
+Load test a running app: send its callbacks many concurrent requests, like visitors
+picking formulae and operating systems from the dropdowns, and report requests per
+second, response times, and how much memory each of the server's workers uses. Start
+the server first, e.g. with serve.py, then from the `final_project` folder run
+    python code/serve.py --workers 4 --pidfile /tmp/homebrew-app.pid
+    python code/load_test.py --requests 5000 --pidfile /tmp/homebrew-app.pid
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from typing import Dict, List
+
+import aiohttp
+import numpy as np
+
+import app_data
+
+# The callbacks in app.py the server answers, as (output id, input id) pairs. Switching
+# the OS of the installs and ratio charts happens in the browser
+CALLBACKS = [
+    ("tree-figure", "tree-dropdown"),
+    ("graph-metrics-figure", "graph-metrics-dropdown"),
+]
+
+
+def callback_request(output_id: str, input_id: str, value: str) -> dict:
+    """
+    The body the browser posts to /_dash-update-component when the dropdown `input_id`
+    changes to `value`
+    """
+    return dict(
+        output=f"{output_id}.figure",
+        outputs=dict(id=output_id, property="figure"),
+        inputs=[dict(id=input_id, property="value", value=value)],
+        changedPropIds=[f"{input_id}.value"],
+    )
+
+
+def make_requests(formulae: List[str], n: int, seed: int = 0) -> List[dict]:
+    """
+    n callback requests. About half pick a dependency tree, with popular formulae
+    picked far more often than the rest, and the others switch the metric of the graph
+    metrics chart
+    """
+    rng = random.Random(seed)
+    # Zipf-like popularity over the formulae, in a random order
+    formulae = rng.sample(formulae, len(formulae))
+    cum_weights = list(itertools.accumulate(1 / (r + 1) for r in range(len(formulae))))
+
+    requests = []
+    for _ in range(n):
+        output_id, input_id = rng.choice(CALLBACKS)
+        if input_id == "tree-dropdown":
+            value = rng.choices(formulae, cum_weights=cum_weights)[0]
+        else:
+            value = rng.choice(["transitive_dependents", "impact_installs", "pagerank"])
+        requests.append(callback_request(output_id, input_id, value))
+    return requests
+
+
+async def send_all(url: str, requests: List[dict], concurrency: int) -> List[tuple]:
+    """
+    Post every request, at most `concurrency` at a time, and return the status and
+    seconds taken of each
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def send(session: aiohttp.ClientSession, body: dict) -> tuple:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(url, json=body) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+            return status, time.perf_counter() - start
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await asyncio.gather(*[send(session, body) for body in requests])
+
+
+def worker_memory(main_pid: int) -> List[Dict[str, float]]:
+    """
+    The memory of each child of the process `main_pid`, from /proc, so Linux only.
+    rss_mb counts shared pages in full for every worker, and pss_mb splits them evenly
+    between the processes sharing them, so adding up pss_mb gives the real total
+    """
+    workers = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The parent's id is the 2nd field after the command, which is in ()
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            if parent != main_pid:
+                continue
+            memory = dict()
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    field, value = line.split(":", 1)
+                    if field in ("Rss", "Pss"):
+                        memory[field.lower() + "_mb"] = int(value.split()[0]) / 1024
+        except (OSError, IndexError, ValueError):
+            continue
+        workers.append(dict(pid=int(pid), **memory))
+    return workers
+
+
+def run(
+    base_url: str, n: int, concurrency: int, data_dir: str, pidfile: str = None
+) -> dict:
+    """
+    Run the load test, and return its results
+    """
+    formulae = app_data.AppData(data_dir).tree_options()
+    requests = make_requests(formulae, n)
+
+    start = time.perf_counter()
+    results = asyncio.run(
+        send_all(
+            base_url.rstrip("/") + "/_dash-update-component", requests, concurrency
+        )
+    )
+    seconds = time.perf_counter() - start
+
+    latencies = np.array([r[1] for r in results]) * 1000
+    report = dict(
+        requests=n,
+        concurrency=concurrency,
+        seconds=seconds,
+        requests_per_second=n / seconds,
+        failed=sum(r[0] != 200 for r in results),
+        latency_ms={f"p{p}": np.percentile(latencies, p) for p in (50, 90, 99)},
+    )
+    if pidfile is not None:
+        with open(pidfile) as f:
+            report["workers"] = worker_memory(int(f.read().strip()))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--data", default=os.path.join(os.path.dirname(__file__), "..", "data")
+    )
+    parser.add_argument(
+        "--pidfile", help="the server's pidfile, to measure its workers"
+    )
+    args = parser.parse_args()
+
+    report = run(args.url, args.requests, args.concurrency, args.data, args.pidfile)
+
+    print(
+        f"{report['requests']} requests in {report['seconds']:.1f}s -- "
+        f"{report['requests_per_second']:.0f} requests/s, {report['failed']} failed"
+    )
+    print(
+        "latency -- "
+        + ", ".join(f"{p} {ms:.0f}ms" for p, ms in report["latency_ms"].items())
+    )
+    for worker in report.get("workers", []):
+        print(
+            f"worker {worker['pid']} -- rss {worker.get('rss_mb', 0):.0f}MB, "
+            f"pss {worker.get('pss_mb', 0):.0f}MB"
+        )
@@ -0,0 +1,249 @@
+"""
+Run the data step as a graph of named stages, the way make runs a build. Each stage
+declares the stages whose results it takes and the files it writes. Stages run on a
+pool of threads as soon as everything they take is ready, so independent ones run side
+by side. A stage is skipped when the fingerprints of its inputs are the same as the last
+time it wrote its files, and those files haven't changed since, so a rerun only redoes
+the stages new data reaches. The fingerprints are kept in the data folder between runs
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple
+
+import pandas as pd
+
+import instrument
+import storage
+
+# Where the fingerprints of every stage's last run are kept, in the data folder
+state_file = "pipeline_state.json"
+
+
+class Stage(NamedTuple):
+    """
+    One step of the pipeline. run(record, *results) is given its record in the run
+    report (see instrument.py), to set rows_in and rows_out in, and the results of the
+    stages in `inputs`, in order, and returns its own result.
+    files are the paths it writes, in the data folder or absolute. Only a stage with
+    files can be skipped, and load() reads its result back from them, for when a stage
+    after it does run. params are anything else its result depends on, such as
+    settings, and max_age is how many seconds its files are used for at most
+    """
+
+    name: str
+    run: Callable[..., Any]
+    inputs: List[str] = []
+    files: List[str] = []
+    load: Callable[[], Any] = None
+    params: tuple = ()
+    max_age: float = None
+
+
+def upstream(stages: Dict[str, Stage], targets: List[str]) -> List[str]:
+    """
+    The names of the targets and of every stage they need, directly or not, ordered so
+    each stage comes after its inputs
+    """
+    order = []
+    # 0 while a stage's inputs are being visited, 1 once it is in the order
+    visited = dict()
+    for target in targets:
+        stack = [(target, False)]
+        while stack:
+            name, inputs_done = stack.pop()
+            if name not in stages:
+                raise ValueError(f"Unknown stage {name}")
+            if inputs_done:
+                visited[name] = 1
+                order.append(name)
+                continue
+            if visited.get(name) == 1:
+                continue
+            if visited.get(name) == 0:
+                raise ValueError(f"Stage {name} depends on itself")
+            visited[name] = 0
+            stack.append((name, True))
+            stack += [(i, False) for i in reversed(stages[name].inputs)]
+    return order
+
+
+def file_digest(path: str, known: Dict[str, list]) -> str:
+    """
+    A digest of the file's contents. known maps paths to the [mtime_ns, size, digest]
+    they were last seen with, so a file that hasn't been touched isn't read again
+    """
+    stat = os.stat(path)
+    seen = known.get(path)
+    if seen is not None and seen[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return seen[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    known[path] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+    return known[path][2]
+
+
+def files_fingerprint(paths: List[str], known: Dict[str, list]) -> str:
+    """
+    One digest of every file in paths, and of every file under the folders in it.
+    Files that don't exist count as missing, rather than failing
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(folder, f)
+                for folder, _, names in os.walk(path)
+                for f in names
+            )
+        for file in files:
+            present = os.path.isfile(file)
+            digest.update(os.path.relpath(file, path).encode())
+            digest.update(file_digest(file, known).encode() if present else b"missing")
+    return digest.hexdigest()
+
+
+def value_fingerprint(value: Any) -> str:
+    """
+    A digest of a stage's result, for stages that don't write files. Tables are
+    hashed with pandas, dicts item by item, and anything else as JSON
+    """
+    digest = hashlib.sha256()
+    values = [value]
+    while values:
+        value = values.pop()
+        if isinstance(value, pd.DataFrame):
+            digest.update(json.dumps([str(c) for c in value.columns]).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=False).values)
+        elif isinstance(value, dict):
+            for key in sorted(value, key=str, reverse=True):
+                values += [value[key], str(key)]
+        else:
+            digest.update(json.dumps(value, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def read_state(filename: str) -> dict:
+    if not os.path.isfile(filename):
+        return dict(stages=dict(), files=dict())
+    with open(filename) as f:
+        return json.loads(f.read())
+
+
+def write_state(state: dict, filename: str):
+    with storage.atomic_write(filename) as f:
+        f.write(json.dumps(state, indent=1))
+
+
+def run(
+    stages: List[Stage],
+    data_dir: str,
+    report: instrument.RunReport,
+    targets: List[str] = None,
+    workers: int = 4,
+    force: bool = False,
+) -> Dict[str, str]:
+    """
+    Run the stages in targets, or all of them, and the stages they need, on `workers`
+    threads, skipping those that are up to date unless force is set. Returns whether
+    each stage "ran" or was "skipped"
+    """
+    by_name = {stage.name: stage for stage in stages}
+    order = upstream(by_name, targets or list(by_name))
+    state_path = os.path.join(data_dir, state_file)
+    state = read_state(state_path)
+    known = state["files"]
+
+    # Which stages take each stage's result, so it can be let go once they have it
+    takers = {name: [n for n in order if name in by_name[n].inputs] for name in order}
+    waiting_for = {name: set(by_name[name].inputs) for name in order}
+    results = dict()
+    fingerprints = dict()
+    load_locks = {name: threading.Lock() for name in order}
+    # Stages hash their files against a copy of the known digests, and the new ones are
+    # added here between stages
+    known_lock = threading.Lock()
+
+    def paths(stage: Stage) -> List[str]:
+        return [os.path.join(data_dir, f) for f in stage.files]
+
+    def result(name: str) -> Any:
+        # A skipped stage's result is only read back from its files once it's needed
+        with load_locks[name]:
+            if name not in results:
+                results[name] = by_name[name].load()
+            return results[name]
+
+    def up_to_date(stage: Stage, inputs: str, seen: Dict[str, list]) -> bool:
+        last = state["stages"].get(stage.name)
+        if force or not stage.files or last is None or last["inputs"] != inputs:
+            return False
+        if stage.load is None and takers[stage.name]:
+            return False
+        if not all(os.path.exists(p) for p in paths(stage)):
+            return False
+        if stage.max_age is not None and any(
+            time.time() - os.path.getmtime(p) > stage.max_age for p in paths(stage)
+        ):
+            return False
+        # Otherwise the files were changed by something else since
+        return files_fingerprint(paths(stage), seen) == last["outputs"]
+
+    def execute(stage: Stage) -> tuple:
+        inputs = hashlib.sha256(
+            json.dumps(
+                [stage.name, stage.params, [fingerprints[i] for i in stage.inputs]],
+                default=str,
+            ).encode()
+        ).hexdigest()
+        with known_lock:
+            seen = dict(known)
+        with report.stage(stage.name) as record:
+            if up_to_date(stage, inputs, seen):
+                record["skipped"] = True
+                return "skipped", inputs, state["stages"][stage.name]["outputs"], seen
+            value = stage.run(record, *[result(i) for i in stage.inputs])
+        results[stage.name] = value
+        outputs = (
+            files_fingerprint(paths(stage), seen)
+            if stage.files
+            else value_fingerprint(value)
+        )
+        return "ran", inputs, outputs, seen
+
+    statuses = dict()
+    with ThreadPoolExecutor(workers) as pool:
+        running = dict()
+        ready = [name for name in order if not waiting_for[name]]
+        while ready or running:
+            for name in ready:
+                running[pool.submit(execute, by_name[name])] = name
+            ready = []
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # A failed stage stops the run, once the stages already running finish
+                statuses[name], inputs, fingerprints[name], seen = future.result()
+                with known_lock:
+                    known.update(seen)
+                state["stages"][name] = dict(inputs=inputs, outputs=fingerprints[name])
+                write_state(state, state_path)
+
+                for taker in takers[name]:
+                    waiting_for[taker].discard(name)
+                    if not waiting_for[taker]:
+                        ready.append(taker)
+                for done in by_name[name].inputs + [name]:
+                    # Nothing left to take it, so let its memory go
+                    if all(t in statuses for t in takers[done]):
+                        results.pop(done, None)
+            ready.sort(key=order.index)
+    return statuses
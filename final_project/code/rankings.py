@@ -0,0 +1,85 @@
+"""
+Ranked top-N tables of the formula installs, made once when the data is refreshed, so
+the figures only slice them instead of filtering, grouping and sorting the whole install
+table on every draw. For each OS, window (n_days) and metric, the max_rank formulae
+highest in that metric are kept, with their rank, and their values in every window
+"""
+from typing import List
+
+import pandas as pd
+
+import schema
+
+# The columns of formula_installs.csv formulae are ranked by
+metrics = ["count_regular", "count_on_request", "pct_on_request"]
+
+# How many formulae are kept for each OS, window and metric. Any top N up to this can
+# be sliced from the table
+max_rank = 100
+
+
+def top_n_table(
+    formula_installs: pd.DataFrame,
+    max_rank: int = max_rank,
+    metrics: List[str] = metrics,
+) -> pd.DataFrame:
+    """
+    One row per OS, window, metric and rank, with columns os, n_days, metric, rank,
+    formula, value (the metric in that window), and <metric>_<n>d for each metric in
+    each window, e.g. pct_on_request_30d, so the same formulae can be compared across
+    windows. Ties are broken by name
+    """
+    df = formula_installs[["os", "n_days", "formula"] + metrics]
+
+    # Every metric of every window side by side, one row per OS and formula
+    wide = df.set_index(["os", "formula", "n_days"])[metrics].unstack("n_days")
+    wide.columns = [f"{metric}_{n_days}d" for metric, n_days in wide.columns]
+
+    ranked = (
+        df.melt(id_vars=["os", "n_days", "formula"], var_name="metric")
+        .dropna(subset=["value"])
+        .assign(name=lambda x: x.formula.astype(str))
+        .sort_values(
+            ["os", "n_days", "metric", "value", "name"],
+            ascending=[True, True, True, False, True],
+        )
+    )
+    ranked["rank"] = ranked.groupby(
+        ["os", "n_days", "metric"], observed=True
+    ).cumcount()
+    ranked["rank"] += 1
+    ranked = ranked.loc[ranked["rank"].le(max_rank)].drop(columns="name")
+
+    table = ranked.join(wide, on=["os", "formula"])
+    return schema.apply_schema(
+        table[
+            ["os", "n_days", "metric", "rank", "formula", "value"] + list(wide.columns)
+        ].reset_index(drop=True)
+    )
+
+
+def top_n(
+    table: pd.DataFrame,
+    which_os: str,
+    n_days: int,
+    metric: str = "count_regular",
+    n: int = 20,
+) -> pd.DataFrame:
+    """
+    The top n formulae on which_os over n_days by metric, from a top_n_table, in order
+    """
+    rows = table.loc[
+        table.os.eq(which_os)
+        & table.n_days.eq(n_days)
+        & table.metric.eq(metric)
+        & table["rank"].le(n)
+    ]
+    return rows.sort_values("rank")
+
+
+def ensure_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    df if it is already a top_n_table, and the top_n_table of it if it is the whole
+    table of formula installs
+    """
+    return df if "rank" in df.columns else top_n_table(df)
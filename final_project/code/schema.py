@@ -0,0 +1,119 @@
+"""
+The compact dtypes every table in the pipeline is stored with. Formula, cask and package
+names are categoricals sharing one category dictionary, so joins and filters compare
+integer codes instead of strings, and numbers use the narrowest type that fits them.
+"""
+
+import itertools
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+# Columns holding formula/cask names, which all share one category dictionary
+NAME_COLUMNS = ["formula", "cask", "package", "depends_on"]
+
+OS_DTYPE = pd.CategoricalDtype(["macos", "linux"])
+
+NUMERIC_DTYPES = {
+    "number": np.int32,
+    "count": np.int32,
+    "count_regular": np.int32,
+    "count_on_request": np.int32,
+    "n_days": np.int16,
+    "percent": np.float32,
+    "percent_regular": np.float32,
+    "percent_on_request": np.float32,
+    "pct_on_request": np.float32,
+    "rank": np.int16,
+    "dependencies": np.int32,
+    "dependents": np.int32,
+    "transitive_dependencies": np.int32,
+    "transitive_dependents": np.int32,
+    "depth": np.int16,
+    "pagerank": np.float64,
+    "installs": np.int64,
+    "impact_installs": np.int64,
+}
+
+
+def name_dtype(*name_collections: Iterable[str]) -> pd.CategoricalDtype:
+    """
+    One category dictionary covering every name in all of the collections given
+    """
+    names = set(itertools.chain.from_iterable(name_collections))
+    names.discard(None)
+    return pd.CategoricalDtype(sorted(n for n in names if isinstance(n, str)))
+
+
+def os_dtype(values: pd.Series) -> pd.CategoricalDtype:
+    """
+    OS_DTYPE, extended with any other operating systems found in values
+    """
+    extra = sorted(set(values.dropna().unique()).difference(OS_DTYPE.categories))
+    if not extra:
+        return OS_DTYPE
+    return pd.CategoricalDtype(list(OS_DTYPE.categories) + extra)
+
+
+def frame_names(df: pd.DataFrame) -> Iterable[str]:
+    """
+    Every distinct name in the name columns of df
+    """
+    return itertools.chain.from_iterable(
+        df[c].unique() for c in NAME_COLUMNS if c in df.columns
+    )
+
+
+def apply_schema(df: pd.DataFrame, names: pd.CategoricalDtype = None) -> pd.DataFrame:
+    """
+    Return a copy of df with every known column cast to its compact dtype. Name columns
+    use the category dictionary `names`. If it isn't given, they keep the dictionary
+    they already share, or get one built from df.
+    Integer columns whose values don't fit their narrow type are left as they are
+    """
+    if names is None:
+        existing = [df[c].dtype for c in NAME_COLUMNS if c in df.columns]
+        if existing and all(
+            isinstance(d, pd.CategoricalDtype)
+            and (d is existing[0] or d == existing[0])
+            for d in existing
+        ):
+            names = existing[0]
+        else:
+            names = name_dtype(frame_names(df))
+
+    dtypes = dict()
+    for column in df.columns:
+        if column in NAME_COLUMNS:
+            dtypes[column] = names
+        elif column == "os":
+            dtypes[column] = os_dtype(df[column])
+        elif column in NUMERIC_DTYPES:
+            target = NUMERIC_DTYPES[column]
+            if np.issubdtype(target, np.integer) and len(df) > 0:
+                info = np.iinfo(target)
+                if df[column].min() < info.min or df[column].max() > info.max:
+                    continue
+            dtypes[column] = target
+    return df.astype(dtypes)
+
+
+def memory_report(
+    before: Dict[str, pd.DataFrame], after: Dict[str, pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Bytes used by each named frame before and after applying the schema
+    """
+    report = pd.DataFrame(
+        [
+            dict(
+                frame=name,
+                bytes_before=before[name].memory_usage(deep=True).sum(),
+                bytes_after=after[name].memory_usage(deep=True).sum(),
+            )
+            for name in before
+        ]
+    )
+    report["ratio"] = report.bytes_before / report.bytes_after
+    return report
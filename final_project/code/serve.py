@@ -0,0 +1,89 @@
+"""
+Serve the app in production, with several worker processes under gunicorn. The data is
+read, and the most requested figures built, once in the parent process before the
+workers are forked, so they share that memory rather than each holding a copy.
+
+Unlike `python code/app.py`, this doesn't refresh the data or run the debug reloader.
+Refresh the data separately, e.g. with cron running `python code/get_and_clean_data.py`,
+and each worker picks up the new files by itself. That reread happens in each worker on
+its own, so after the first refresh every worker holds its own copy of the new data, and
+the sharing only lasts until then. Restart the server after a refresh to share it again.
+The columnar files are memory mapped when read, but building tables from them copies the
+columns into each process's memory, so it is the preloaded tables that are shared, not
+the page cache. From the `final_project` folder, run
+    python code/serve.py --workers 4 --bind 0.0.0.0:8050
+"""
+
+import argparse
+import gc
+import multiprocessing
+
+import app
+
+
+def preload():
+    """
+    Read every data file the app uses, and fill the figure cache, in this process
+    """
+    app.data.formula_installs()
+    app.data.top_formulae()
+    app.data.dep_edges()
+    app.data.dep_closure()
+    app.data.graph_metrics()
+    app.get_tree_options()
+    app.dep_heatmap()
+    app.prewarm_figures()
+
+    # Move everything loaded so far out of the garbage collector's reach. Otherwise
+    # each worker's collections would write to the shared pages, which copies them
+    gc.freeze()
+
+
+def run(bind: str, workers: int, threads: int, timeout: int, pidfile: str = None):
+    """
+    Preload the data, and serve the app with gunicorn until it is stopped
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit(
+            "Serving with several workers needs gunicorn: pip install gunicorn"
+        )
+
+    options = dict(
+        bind=bind,
+        workers=workers,
+        threads=threads,
+        timeout=timeout,
+        pidfile=pidfile,
+        # Fork the workers from this process, after preload(), instead of having each
+        # one import the app and read the data for itself
+        preload_app=True,
+    )
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app.app.server
+
+    preload()
+    Server().run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--bind", default="127.0.0.1:8050")
+    parser.add_argument(
+        "--workers", type=int, default=min(4, multiprocessing.cpu_count())
+    )
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument(
+        "--pidfile", help="where to write the main process' id, e.g. for load_test.py"
+    )
+    args = parser.parse_args()
+
+    run(args.bind, args.workers, args.threads, args.timeout, args.pidfile)
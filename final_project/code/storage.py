@@ -0,0 +1,164 @@
+"""
+Read and write the pipeline's tables. Besides the CSV and JSON files, each table can be
+saved in a columnar form: a folder next to the text file holding one memory-mappable
+.npy file per column, with text columns stored as integer codes into a string table.
+Readers use the columnar copy when there is one, and only load the columns they need.
+"""
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+import schema
+
+EDGE_COLUMNS = ["package", "depends_on"]
+
+
+def columnar_path(filename: str) -> str:
+    """
+    Where the columnar copy of `filename` lives, e.g. data/formula_installs.cols for
+    data/formula_installs.csv
+    """
+    return os.path.splitext(filename)[0] + ".cols"
+
+
+@contextmanager
+def atomic_write(filename: str, mode: str = "w") -> Iterator[IO]:
+    """
+    Open a temporary file next to `filename` to write, which takes its place once the
+    with block finishes, so a reader never sees half of it. Safe to use from several
+    threads or processes at once, the last one to finish wins
+    """
+    temporary = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, mode) as f:
+            yield f
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+@contextmanager
+def folder_replacement(directory: str) -> Iterator[str]:
+    """
+    An empty temporary folder next to `directory`, to write a new version of it in.
+    Once the with block finishes, it is renamed to `directory`, replacing the old one,
+    so old and new files are never mixed, and a reader sees the whole old folder, the
+    whole new one, or (for a moment) none at all
+    """
+    temporary = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+    old = f"{directory}.{os.getpid()}.{threading.get_ident()}.old"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    try:
+        yield temporary
+        if os.path.isdir(directory):
+            os.rename(directory, old)
+        os.rename(temporary, directory)
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def write_columnar(df: pd.DataFrame, filename: str):
+    """
+    Save the columnar copy of `filename`. Numeric columns are saved with their own
+    dtype, and every other column as int32 codes into a table of its distinct strings
+    """
+    with folder_replacement(columnar_path(filename)) as directory:
+        schema = dict(rows=len(df), columns=[])
+        for name in df.columns:
+            col = df[name]
+            path = os.path.join(directory, f"{name}.npy")
+            if pd.api.types.is_numeric_dtype(col) and not isinstance(
+                col.dtype, pd.CategoricalDtype
+            ):
+                values = col.to_numpy()
+                np.save(path, values)
+                schema["columns"].append(dict(name=name, dtype=str(values.dtype)))
+            else:
+                codes, strings = pd.factorize(col.astype(object), use_na_sentinel=True)
+                np.save(path, codes.astype(np.int32))
+                with open(os.path.join(directory, f"{name}.strings.json"), "w") as f:
+                    f.write(json.dumps([str(s) for s in strings]))
+                schema["columns"].append(dict(name=name, dtype="category"))
+
+        with open(os.path.join(directory, "schema.json"), "w") as f:
+            f.write(json.dumps(schema))
+
+
+def read_columnar(filename: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Load the columnar copy of `filename`, memory mapping the numeric columns. Text
+    columns come back as categoricals built straight from their codes
+    """
+    directory = columnar_path(filename)
+    with open(os.path.join(directory, "schema.json")) as f:
+        schema = json.loads(f.read())
+
+    data = dict()
+    for column in schema["columns"]:
+        name = column["name"]
+        if columns is not None and name not in columns:
+            continue
+        values = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        if column["dtype"] == "category":
+            with open(os.path.join(directory, f"{name}.strings.json")) as f:
+                strings = json.loads(f.read())
+            values = pd.Categorical.from_codes(np.asarray(values), categories=strings)
+        data[name] = values
+    return pd.DataFrame(data, columns=columns)
+
+
+def has_columnar(filename: str) -> bool:
+    """
+    Whether there is a complete columnar copy of `filename` that is at least as new as
+    the text file itself
+    """
+    schema = os.path.join(columnar_path(filename), "schema.json")
+    if not os.path.isfile(schema):
+        return False
+    if not os.path.isfile(filename):
+        return True
+    return os.path.getmtime(schema) >= os.path.getmtime(filename)
+
+
+def file_version(filename: str) -> tuple:
+    """
+    A value that changes whenever `filename`, or its columnar copy, is rewritten. None
+    in place of a file that doesn't exist
+    """
+    version = []
+    for path in [filename, os.path.join(columnar_path(filename), "schema.json")]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def read_frame(filename: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    The one way figures and the app read a table. Uses the columnar copy of `filename`
+    if it exists, and otherwise parses the CSV, or the JSON list of
+    [package, depends_on] edges. Either way, the columns get the dtypes in schema.py
+    """
+    if has_columnar(filename):
+        df = read_columnar(filename, columns)
+    else:
+        assert os.path.isfile(filename), f"Could not find file {filename}"
+        if filename.endswith(".json"):
+            with open(filename) as fio:
+                df = pd.DataFrame(data=json.loads(fio.read()), columns=EDGE_COLUMNS)
+            df = df if columns is None else df[columns]
+        else:
+            df = pd.read_csv(filename, usecols=columns)
+    return schema.apply_schema(df)
@@ -0,0 +1,79 @@
+"""
+Compute coordinates for drawing a dependency tree directly from the graph structure
+"""
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+
+class TreeLayout(NamedTuple):
+    """
+    Node positions and labels, plus edge segments separated by NaN so that all of the
+    edges can be drawn as a single line trace
+    """
+
+    node_x: np.ndarray
+    node_y: np.ndarray
+    node_text: List[str]
+    edge_x: np.ndarray
+    edge_y: np.ndarray
+
+
+def layout_tree(
+    adjacency: Dict[str, List[str]], root: str, dag: bool = False
+) -> TreeLayout:
+    """
+    Place every formula below `root` on a grid: x is its depth in the tree, and y
+    counts down one row per node in depth-first order. Each edge is an elbow from the
+    parent's column down to the child's row.
+
+    With dag=True, a dependency shared by several formulas is only drawn once, where it
+    is first reached, and every formula that needs it gets an edge to that one node.
+    Otherwise, a dependency that leads back around a cycle is drawn where it is reached,
+    but its own dependencies are not drawn again below it
+    """
+    xs = []
+    text = []
+    edges = []
+    placed = dict()
+    on_path = set()
+
+    # Iterative depth first walk, children pushed in reverse so they come out in order.
+    # A depth of -1 marks the point where the walk leaves a formula's subtree
+    stack = [(root, 0, -1)]
+    while stack:
+        formula, depth, parent = stack.pop()
+        if depth < 0:
+            on_path.discard(formula)
+            continue
+        if dag and formula in placed:
+            edges.append((parent, placed[formula]))
+            continue
+
+        index = len(text)
+        text.append(formula)
+        xs.append(depth)
+        if parent >= 0:
+            edges.append((parent, index))
+        if dag:
+            placed[formula] = index
+        if formula in on_path:
+            continue
+
+        on_path.add(formula)
+        stack.append((formula, -1, index))
+        stack.extend(
+            (dep, depth + 1, index) for dep in reversed(adjacency.get(formula, []))
+        )
+
+    node_x = np.array(xs, dtype=np.int32)
+    node_y = -np.arange(len(text), dtype=np.int32)
+
+    edges = np.array(edges, dtype=np.int32).reshape(-1, 2)
+    parent_x, parent_y = node_x[edges[:, 0]], node_y[edges[:, 0]]
+    child_x, child_y = node_x[edges[:, 1]], node_y[edges[:, 1]]
+    gap = np.full(len(edges), np.nan)
+    edge_x = np.column_stack([parent_x, parent_x, child_x, gap]).ravel()
+    edge_y = np.column_stack([parent_y, child_y, child_y, gap]).ravel()
+
+    return TreeLayout(node_x, node_y, text, edge_x, edge_y)
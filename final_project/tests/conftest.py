@@ -0,0 +1,80 @@
+"""
+The modules in code/ import each other by name, as they do when run from there
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "code"))
+
+import hashlib
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+example_data = os.path.join(os.path.dirname(__file__), "..", "example_data")
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files in the server's folder, with an ETag, and 304 when the request's
+    If-None-Match matches it. /flaky/<file> answers 503 the first server.failures
+    times it is asked for
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path.startswith("/flaky/"):
+            with self.server.lock:
+                failing = self.server.failures > 0
+                self.server.failures -= 1
+            if failing:
+                self.send_error(503)
+                return
+            self.path = self.path[len("/flaky") :]
+
+        filename = os.path.join(self.server.directory, self.path.lstrip("/"))
+        if not os.path.isfile(filename):
+            self.send_error(404)
+            return
+        with open(filename, "rb") as f:
+            body = f.read()
+        etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_server():
+    """
+    Start a local server for a folder, example_data by default, and return it. Its
+    url is server.url, and server.requests lists the paths asked for
+    """
+    servers = []
+
+    def start(directory: str = example_data, failures: int = 0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        server.directory = directory
+        server.failures = failures
+        server.requests = []
+        server.lock = threading.Lock()
+        server.url = f"http://127.0.0.1:{server.server_address[1]}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+
+import async_fetch
+from conftest import example_data
+
+
+def read_example(name):
+    with open(os.path.join(example_data, name)) as f:
+        return json.loads(f.read())
+
+
+def test_found_in_order(stand_in_server):
+    server = stand_in_server()
+    names = ["dep_graph.json", "requirements_graph.json", "dep_closure.json"]
+    results = async_fetch.fetch_json_many(
+        [f"{server.url}/{name}" for name in names], concurrency=2
+    )
+    assert results == [read_example(name) for name in names]
+
+
+def test_missing_gives_empty_dict(stand_in_server):
+    server = stand_in_server()
+    results = async_fetch.fetch_json_many(
+        [f"{server.url}/no_such_formula.json", f"{server.url}/dep_graph.json"]
+    )
+    assert results[0] == dict()
+    assert results[1] == read_example("dep_graph.json")
+    # A 404 is an answer, not a failure, so it isn't asked for again
+    assert server.requests.count("/no_such_formula.json") == 1
+
+
+def test_unavailable_is_retried(stand_in_server):
+    server = stand_in_server(failures=2)
+    results = async_fetch.fetch_json_many(
+        [f"{server.url}/flaky/dep_graph.json"], retries=3, backoff=0.01
+    )
+    assert results == [read_example("dep_graph.json")]
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_retries(stand_in_server):
+    server = stand_in_server(failures=10)
+    with pytest.warns(UserWarning):
+        results = async_fetch.fetch_json_many(
+            [f"{server.url}/flaky/dep_graph.json"], retries=2, backoff=0.01
+        )
+    assert results == [dict()]
+    assert len(server.requests) == 3
@@ -0,0 +1,41 @@
+import json
+import pathlib
+
+import pandas as pd
+
+import benchmarks
+import edge_store
+import get_and_clean_data
+import instrument
+import pipeline
+import storage
+
+
+def test_graphs_are_read_from_the_store_after_a_run(tmp_path, monkeypatch):
+    sources = benchmarks.write_synthetic_sources(str(tmp_path / "sources"), 1)
+    monkeypatch.setattr(get_and_clean_data, "install_and_error_urls", sources["urls"])
+    monkeypatch.setattr(
+        get_and_clean_data,
+        "formula_catalog_url",
+        pathlib.Path(sources["catalog"]).absolute().as_uri(),
+    )
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    pipeline.run(
+        get_and_clean_data.pipeline_stages(str(data_dir)),
+        str(data_dir),
+        instrument.RunReport(),
+        ["dep_closure"],
+    )
+
+    def read_json(filename):
+        raise AssertionError(f"{filename} was parsed rather than read from the store")
+
+    monkeypatch.setattr(storage, "read_frame", read_json)
+    for kind, name in edge_store.GRAPH_FILES.items():
+        if kind == "requirements":
+            continue
+        with open(data_dir / name) as f:
+            expected = pd.DataFrame(json.loads(f.read()), columns=storage.EDGE_COLUMNS)
+        edges = edge_store.read_graph(str(data_dir / name))
+        assert edges.astype(str).values.tolist() == expected.values.tolist()
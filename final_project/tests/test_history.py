@@ -0,0 +1,62 @@
+import os
+from datetime import date
+
+import pandas as pd
+
+import history
+import schema
+
+
+def installs(formulae):
+    return schema.apply_schema(
+        pd.DataFrame(
+            dict(
+                formula=[f for f in formulae for _ in range(2)],
+                os=["macos", "linux"] * len(formulae),
+                n_days=[30, 30] * len(formulae),
+                count_regular=range(2 * len(formulae)),
+            )
+        )
+    )
+
+
+def test_snapshot_of_non_alphabetical_categories(tmp_path):
+    # As storage.read_columnar returns it, with categories in the order first seen
+    df = installs(["zlib", "openssl", "gettext"])
+    df["formula"] = pd.Categorical(
+        df.formula.astype(str), categories=["zlib", "openssl", "gettext"]
+    )
+    day = date(2026, 1, 1)
+    history.append_snapshot(df, str(tmp_path), "formula_installs", day)
+
+    found = history.read_snapshot(
+        str(tmp_path), "formula_installs", day, ["gettext", "openssl", "zlib"]
+    )
+    assert len(found) == 6
+    for formula, counts in [("zlib", [0, 1]), ("openssl", [2, 3]), ("gettext", [4, 5])]:
+        rows = found.loc[found.formula.astype(str) == formula]
+        assert sorted(rows.count_regular) == counts
+
+
+def test_trend_reads_every_snapshot(tmp_path):
+    for day in [date(2026, 1, 1), date(2026, 1, 2)]:
+        history.append_snapshot(
+            installs(["wget", "curl"]), str(tmp_path), "formula_installs", day
+        )
+    trend = history.trend(str(tmp_path), "formula_installs", ["wget"])
+    assert len(trend) == 4
+    assert set(trend.formula.astype(str)) == {"wget"}
+
+
+def test_same_day_snapshot_is_only_rewritten_if_changed(tmp_path):
+    day = date(2026, 1, 1)
+    path = history.append_snapshot(
+        installs(["wget"]), str(tmp_path), "formula_installs", day
+    )
+    written = os.stat(path).st_mtime_ns
+    history.append_snapshot(installs(["wget"]), str(tmp_path), "formula_installs", day)
+    assert os.stat(path).st_mtime_ns == written
+
+    history.append_snapshot(installs(["curl"]), str(tmp_path), "formula_installs", day)
+    found = history.read_snapshot(str(tmp_path), "formula_installs", day)
+    assert set(found.formula.astype(str)) == {"curl"}
@@ -0,0 +1,29 @@
+import json
+
+import http_cache
+
+
+def test_stale_entry_is_revalidated(stand_in_server, tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "30d.json").write_text(json.dumps(dict(items=[1, 2])))
+    server = stand_in_server(str(served))
+    url = f"{server.url}/30d.json"
+    cache = http_cache.ResponseCache(str(tmp_path / "cache"))
+
+    assert json.loads(cache.fetch(url)) == dict(items=[1, 2])
+    # Fresh, so the server isn't asked
+    cache.fetch(url)
+    assert len(server.requests) == 1
+
+    # Stale but unchanged, so the server answers 304 and nothing is downloaded
+    downloaded = cache.stats["bytes_downloaded"]
+    assert json.loads(cache.fetch(url, ttl=0)) == dict(items=[1, 2])
+    assert cache.stats["revalidated"] == 1
+    assert cache.stats["bytes_downloaded"] == downloaded
+
+    # Stale and changed, so it is downloaded again
+    (served / "30d.json").write_text(json.dumps(dict(items=[3])))
+    assert json.loads(cache.fetch(url, ttl=0)) == dict(items=[3])
+    assert cache.stats["misses"] == 2
+    assert len(server.requests) == 3
@@ -0,0 +1,90 @@
+import io
+import json
+import random
+
+import pytest
+
+import json_stream
+
+
+def random_number(rng):
+    return rng.choice(
+        [
+            rng.randint(-(10**12), 10**12),
+            rng.uniform(-1000, 1000),
+            rng.uniform(-1, 1) * 10 ** rng.randint(-30, 30),
+            0,
+            0.5,
+        ]
+    )
+
+
+def random_value(rng, depth=0):
+    kinds = ["number", "string", "constant"] + ["list", "dict"] * (depth < 3)
+    kind = rng.choice(kinds)
+    if kind == "number":
+        return random_number(rng)
+    if kind == "string":
+        return "".join(rng.choice('ab "\\\n{}[],:é☃') for _ in range(rng.randint(0, 8)))
+    if kind == "constant":
+        return rng.choice([True, False, None])
+    if kind == "list":
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {f"k{i}": random_value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+
+
+def formula(rng):
+    # Flat, like the formulae in homebrew's catalog when read with flat=True
+    return dict(
+        name=f"f{rng.randint(0, 999)}",
+        installs=random_number(rng),
+        ratio=rng.random(),
+        deps="[a, b]}",
+        ok=rng.choice([True, False, None]),
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 16])
+def test_numbers_split_across_chunks(chunk_size):
+    rng = random.Random(chunk_size)
+    for _ in range(50):
+        values = [random_number(rng) for _ in range(rng.randint(0, 20))]
+        body = json.dumps(values, separators=(",", rng.choice([":", ": "])))
+        stream = io.BytesIO(body.encode())
+        assert list(json_stream.iter_json_array(stream, chunk_size=chunk_size)) == (
+            json.loads(body)
+        )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 16])
+@pytest.mark.parametrize("text", [False, True])
+def test_any_values_split_across_chunks(chunk_size, text):
+    rng = random.Random(chunk_size)
+    for _ in range(30):
+        values = [random_value(rng) for _ in range(rng.randint(0, 10))]
+        body = json.dumps(values, indent=rng.choice([None, 1]), ensure_ascii=False)
+        stream = io.StringIO(body) if text else io.BytesIO(body.encode())
+        assert list(json_stream.iter_json_array(stream, chunk_size=chunk_size)) == (
+            json.loads(body)
+        )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 16])
+@pytest.mark.parametrize("flat", [False, True])
+def test_array_under_key(chunk_size, flat):
+    rng = random.Random(chunk_size)
+    for _ in range(30):
+        document = dict(
+            before=random_value(rng),
+            formulae=[formula(rng) for _ in range(rng.randint(0, 10))],
+            after=random_number(rng),
+        )
+        body = json.dumps(document)
+        stream = io.BytesIO(body.encode())
+        parsed = json_stream.iter_json_array(stream, "formulae", flat, chunk_size)
+        assert list(parsed) == json.loads(body)["formulae"]
+
+
+def test_missing_key():
+    with pytest.raises(KeyError):
+        list(json_stream.iter_json_array(io.BytesIO(b'{"a": [1]}'), "b"))
@@ -0,0 +1,36 @@
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+
+
+def test_rewritten_columnar_copy_has_only_new_columns(tmp_path):
+    filename = str(tmp_path / "formula_installs.csv")
+    storage.write_columnar(
+        pd.DataFrame(dict(formula=["a", "b"], count=[1, 2])), filename
+    )
+    storage.write_columnar(pd.DataFrame(dict(count=[3])), filename)
+
+    assert sorted(os.listdir(storage.columnar_path(filename))) == [
+        "count.npy",
+        "schema.json",
+    ]
+    assert storage.read_columnar(filename).to_dict("list") == dict(count=[3])
+    # No temporary folders are left next to it
+    assert os.listdir(tmp_path) == ["formula_installs.cols"]
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    filename = str(tmp_path / "pipeline_state.json")
+    with storage.atomic_write(filename) as f:
+        f.write("old")
+    with pytest.raises(RuntimeError):
+        with storage.atomic_write(filename) as f:
+            f.write("half of the n")
+            raise RuntimeError
+
+    with open(filename) as f:
+        assert f.read() == "old"
+    assert os.listdir(tmp_path) == ["pipeline_state.json"]